@@ -0,0 +1,239 @@
+"""
+Cross-process message bus between server workers.
+
+Everything a worker keeps in memory (WebSocket connections, the active
+event cache, results versions, vote tallies) only exists in that process.
+With several uvicorn workers, each one publishes what it changed on the
+bus and the other workers apply it to their own sockets and caches.
+
+Backends, selected by WS_BROADCAST_BACKEND:
+
+* ``local`` (default): a single process, publish() is a no-op.
+* ``unix``: workers connect to a broker on a Unix domain socket
+  (WS_BROKER_PATH) that relays every message to all other workers. The
+  broker runs inside whichever worker first takes the lock file next to
+  the socket; if that worker exits another one takes over. Messages
+  published while no broker is reachable are dropped and counted.
+
+Subscribers register with ``bus.subscribe(channel, handler)``; handlers
+run on the event loop and only ever see messages from other workers.
+Messages sent while a worker was cut off from the broker never reach it,
+so caches kept current by the bus also register ``bus.on_connect(callback)``
+to drop or reload what they hold each time the worker (re)connects.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+BACKEND = os.getenv("WS_BROADCAST_BACKEND", "local")
+BROKER_PATH = os.getenv("WS_BROKER_PATH", "app.broker.sock")
+# Seconds between attempts to reach (or become) the broker
+RECONNECT_DELAY = float(os.getenv("WS_BROKER_RECONNECT", "1"))
+# A peer whose unsent bytes exceed this is too slow; its messages are dropped (bytes)
+MAX_PEER_BUFFER = int(os.getenv("WS_BROKER_MAX_BUFFER", str(8 * 1024 * 1024)))
+
+class LocalBackend:
+    """Single process: nothing to forward"""
+    distributed = False
+
+    def __init__(self):
+        self.stats = {"sent": 0, "received": 0, "dropped": 0}
+
+    async def start(self, on_message: Callable[[bytes], None], on_connect: Callable[[], Awaitable[None]]):
+        pass
+
+    async def stop(self):
+        pass
+
+    def send(self, line: bytes):
+        pass
+
+class UnixSocketBackend:
+    """Workers exchange newline-delimited JSON through a broker on a Unix domain socket"""
+    distributed = True
+
+    def __init__(self, path: str = BROKER_PATH):
+        self.path = os.path.abspath(path)
+        self.stats = {"sent": 0, "received": 0, "dropped": 0, "reconnects": 0, "broker": False}
+        self._on_message = None
+        self._on_connect = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._server = None
+        self._peers: List[asyncio.StreamWriter] = []
+        self._lock_fd = None
+
+    async def start(self, on_message: Callable[[bytes], None], on_connect: Callable[[], Awaitable[None]]):
+        self._on_message = on_message
+        self._on_connect = on_connect
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._server is not None:
+            self._server.close()
+            for peer in self._peers:
+                peer.close()
+            self._server = None
+            self._peers = []
+        if self._lock_fd is not None:
+            # Closing the descriptor releases the lock for the next worker
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def send(self, line: bytes):
+        writer = self._writer
+        if writer is None or writer.is_closing() or writer.transport.get_write_buffer_size() > MAX_PEER_BUFFER:
+            self.stats["dropped"] += 1
+            return
+        writer.write(line)
+        self.stats["sent"] += 1
+
+    async def _run(self):
+        while True:
+            await self._become_broker()
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=MAX_PEER_BUFFER)
+            except OSError:
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            self._writer = writer
+            try:
+                # Resync before reading: what was published while disconnected is lost
+                await self._on_connect()
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self.stats["received"] += 1
+                    self._on_message(line)
+            except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                logger.warning(f"Broker connection lost: {e}")
+            finally:
+                self._writer = None
+                writer.close()
+            self.stats["reconnects"] += 1
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _become_broker(self):
+        """Run the broker in this worker if no other worker holds the lock"""
+        if self._server is not None:
+            return
+        import fcntl  # POSIX only, like Unix domain sockets themselves
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return
+        self._lock_fd = fd
+        # A socket file left by a broker that died is stale: the lock proves nobody serves it
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve_peer, path=self.path, limit=MAX_PEER_BUFFER)
+        self.stats["broker"] = True
+        logger.info(f"Broadcast broker listening on {self.path} (pid {os.getpid()})")
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.append(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for peer in self._peers:
+                    if peer is writer or peer.is_closing():
+                        continue
+                    if peer.transport.get_write_buffer_size() > MAX_PEER_BUFFER:
+                        self.stats["dropped"] += 1
+                        continue
+                    peer.write(line)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            if writer in self._peers:
+                self._peers.remove(writer)
+            writer.close()
+
+BACKENDS = {
+    "local": LocalBackend,
+    "unix": UnixSocketBackend,
+}
+
+class MessageBus:
+    def __init__(self, backend=None):
+        self.backend = backend or LocalBackend()
+        self._handlers: Dict[str, List[Callable]] = {}
+        self._connect_callbacks: List[Callable] = []
+
+    @property
+    def distributed(self) -> bool:
+        """True when other worker processes may exist"""
+        return self.backend.distributed
+
+    def subscribe(self, channel: str, handler: Callable[[dict], None]):
+        """handler(payload) is called for every message other workers publish on channel"""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def on_connect(self, callback: Callable[[], None]):
+        """callback() is called each time this worker (re)connects to the other workers"""
+        self._connect_callbacks.append(callback)
+
+    def publish(self, channel: str, payload: dict):
+        """Forward payload to the other workers. Does not block; a no-op in local mode."""
+        if not self.backend.distributed:
+            return
+        line = json.dumps({"c": channel, "p": payload}, separators=(",", ":"), ensure_ascii=False)
+        self.backend.send(line.encode("utf-8") + b"\n")
+
+    async def start(self):
+        await self.backend.start(self._dispatch, self._connected)
+
+    async def stop(self):
+        await self.backend.stop()
+
+    def _dispatch(self, line: bytes):
+        try:
+            message = json.loads(line)
+            handlers = self._handlers.get(message["c"], ())
+            payload = message["p"]
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Malformed bus message: {e}")
+            return
+        for handler in handlers:
+            try:
+                result = handler(payload)
+                if asyncio.iscoroutine(result):
+                    asyncio.create_task(result)
+            except Exception as e:
+                logger.error(f"Bus handler for {message['c']} failed: {e}")
+
+    async def _connected(self):
+        # Run in registration order: caches registered later may read earlier ones
+        for callback in self._connect_callbacks:
+            try:
+                result = callback()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Bus connect callback failed: {e}")
+
+def create_bus(name: str = BACKEND) -> MessageBus:
+    backend = BACKENDS.get(name)
+    if backend is None:
+        logger.warning(f"Unknown WS_BROADCAST_BACKEND {name!r}, using 'local'")
+        backend = LocalBackend
+    return MessageBus(backend())
+
+bus = create_bus()
@@ -1,19 +1,143 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import time
+from app import metrics
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./app.db"
+logger = logging.getLogger(__name__)
+
+# Overridable so tools (e.g. bench_plugins.py) can run against a scratch database
+SQLALCHEMY_DATABASE_URL = os.getenv("APP_DATABASE_URL", "sqlite:///./app.db")
+
+# SQLite 存储配置档 (Storage profiles)，通过环境变量 APP_DB_PROFILE 选择
+#   journal_mode / synchronous / cache_size / mmap_size / busy_timeout 在每个新连接上以 PRAGMA 设置
+#   pool_size / max_overflow 为连接池大小，threads 为数据库线程池大小 (可被 DB_THREADS 覆盖)
+#   约束: threads <= pool_size + max_overflow。每个 DB 线程同一时刻最多持有一个连接，
+#   只要连接数不少于线程数，线程就永远不会在连接池上等待；启动时不满足会自动扩大 max_overflow
+STORAGE_PROFILES = {
+    # 兼容旧版本：回滚日志，不做任何调优
+    "legacy": {
+        "journal_mode": None,
+        "synchronous": None,
+        "cache_size": None,
+        "mmap_size": None,
+        "busy_timeout": None,
+        "pool_size": 5,
+        "max_overflow": 10,
+        "threads": 4,
+    },
+    # 默认：WAL，读写互不阻塞；每次提交仍然 fsync
+    "default": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -16000,        # 负数表示 KiB，约 16MB
+        "mmap_size": 64 * 1024 * 1024,
+        "busy_timeout": 5000,        # 毫秒
+        "pool_size": 5,
+        "max_overflow": 10,
+        "threads": 4,
+    },
+    # 现场活动：几百人同时签到/答题的突发写入
+    # synchronous=NORMAL 在 WAL 下只在 checkpoint 时 fsync，掉电可能丢失最后几个事务，但不会损坏数据库
+    # 8 个线程对应 8 + 8 个连接：提高 DB_THREADS 时连接池会随之扩大 (见上方约束)
+    "live_event": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,        # 约 64MB
+        "mmap_size": 256 * 1024 * 1024,
+        "busy_timeout": 15000,
+        "pool_size": 8,
+        "max_overflow": 8,
+        "threads": 8,
+    },
+}
+
+DB_PROFILE = os.getenv("APP_DB_PROFILE", "default")
+if DB_PROFILE not in STORAGE_PROFILES:
+    logger.warning(f"Unknown APP_DB_PROFILE '{DB_PROFILE}', using 'default'")
+    DB_PROFILE = "default"
+storage_profile = STORAGE_PROFILES[DB_PROFILE]
+
+# All blocking database work runs on a thread pool of this size instead of the asyncio event loop
+DB_THREADS = int(os.getenv("DB_THREADS", str(storage_profile["threads"])))
+
+# A DB thread holds at most one connection at a time, so with at least as many
+# connections as threads no thread ever waits in pool checkout
+POOL_SIZE = storage_profile["pool_size"]
+MAX_OVERFLOW = storage_profile["max_overflow"]
+if DB_THREADS > POOL_SIZE + MAX_OVERFLOW:
+    logger.warning(f"DB_THREADS={DB_THREADS} exceeds the connection pool ({POOL_SIZE} + {MAX_OVERFLOW}); "
+                   f"raising max_overflow to {DB_THREADS - POOL_SIZE}")
+    MAX_OVERFLOW = DB_THREADS - POOL_SIZE
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@event.listens_for(engine, "connect")
+def apply_storage_profile(dbapi_connection, connection_record):
+    """Apply the selected profile's PRAGMAs to every new SQLite connection"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in ("journal_mode", "synchronous", "cache_size", "mmap_size", "busy_timeout"):
+            value = storage_profile[pragma]
+            if value is not None:
+                cursor.execute(f"PRAGMA {pragma}={value}")
+    finally:
+        cursor.close()
+if metrics.ENABLED:
+    # Statements, their duration and commits, in total and per HTTP request (see app/metrics.py)
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_metrics_started", None)
+        metrics.record_query(statement, parameters, time.perf_counter() - started if started else 0.0)
+
+    @event.listens_for(engine, "commit")
+    def count_commit(conn):
+        metrics.record_commit()
+
+# expire_on_commit=False: reading attributes after commit must not trigger a
+# lazy SELECT on the event loop thread
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 Base = declarative_base()
 
+db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+async def run_sync(func, *args, **kwargs):
+    """Run a blocking call (query, commit...) on the DB thread pool and await its result"""
+    loop = asyncio.get_running_loop()
+    # Run in a copy of the caller's context so per-request counters see the queries
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(db_executor, context.run, functools.partial(func, *args, **kwargs))
+
+async def run_in_session(func, *args, **kwargs):
+    """Open a new session on the DB thread pool, call func(db, *args, **kwargs) and close it"""
+    def call():
+        db = SessionLocal()
+        try:
+            return func(db, *args, **kwargs)
+        finally:
+            db.close()
+    return await run_sync(call)
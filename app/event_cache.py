@@ -0,0 +1,236 @@
+import threading
+from types import SimpleNamespace
+from typing import Optional, List, Dict, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.broadcast import bus
+from app.database import SessionLocal, run_sync, run_in_session
+from app.models import Event, Interaction, Participant
+
+class CachedInteraction:
+    """Detached copy of an enabled Interaction row"""
+    __slots__ = ("id", "event_id", "plugin_id", "name", "config", "is_enabled")
+
+    def __init__(self, interaction: Interaction):
+        self.id = interaction.id
+        self.event_id = interaction.event_id
+        self.plugin_id = interaction.plugin_id
+        self.name = interaction.name
+        self.config = dict(interaction.config or {})
+        self.is_enabled = interaction.is_enabled
+
+class CachedEvent:
+    """Hot fields of the active Event, detached from any DB session"""
+    FIELDS = ("id", "title", "status", "logo_url", "current_interaction_id", "current_plugin_state")
+
+    def __init__(self, event: Event, interactions: List[CachedInteraction]):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(event, field))
+        self.interactions = interactions
+
+    def get_interaction(self, interaction_id: int) -> Optional[CachedInteraction]:
+        for interaction in self.interactions:
+            if interaction.id == interaction_id:
+                return interaction
+        return None
+
+class ActiveEventCache:
+    """
+    Process-level cache of the active event.
+
+    Read-heavy handlers call get() and make no database round trip. Every
+    handler that writes the event or its interactions calls store() (or
+    reload_interactions()) after committing, so the cache is write-through
+    and never serves a state older than the last commit of this process.
+    Both also publish the change on the bus for the other workers.
+    """
+
+    def __init__(self):
+        self._event: Optional[CachedEvent] = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def get(self, db: Session = None) -> Optional[CachedEvent]:
+        if not self._loaded:
+            self.load(db)
+        return self._event
+
+    def load(self, db: Session = None) -> Optional[CachedEvent]:
+        """(Re)load the active event and its enabled interactions from the database"""
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            event = db.query(Event).filter(Event.is_active == True).first()
+            self._set(event, self._query_interactions(db, event) if event else [])
+        finally:
+            if own_session:
+                db.close()
+        return self._event
+
+    def store(self, event: Optional[Event]):
+        """Write-through after a commit that changed the active event's own fields"""
+        self._store(event)
+        # Other workers apply the same fields; they only read the database for a different event
+        fields = {field: getattr(self._event, field) for field in CachedEvent.FIELDS} if self._event else None
+        bus.publish("event", {"fields": fields})
+        return self._event
+
+    def _store(self, event):
+        if event is None or not getattr(event, "is_active", True):
+            self._set(None, [])
+        elif self._event is None or self._event.id != event.id:
+            # A different event became active; events are only activated when
+            # they are created, so it cannot have interactions yet
+            self._set(event, [])
+        else:
+            self._set(event, self._event.interactions)
+
+    async def reload_interactions(self):
+        """Write-through after interactions were created, deleted, toggled or reconfigured"""
+        event = await run_sync(self.load)
+        bus.publish("event", {})
+        return event
+
+    async def _from_bus(self, payload: dict):
+        """Another worker changed the active event or its interactions"""
+        fields = payload.get("fields")
+        if fields and self._event is not None and self._event.id == fields["id"]:
+            # Same event: its fields changed, the interactions did not
+            self._store(SimpleNamespace(**fields))
+        else:
+            await run_sync(self.load)
+
+    async def find_interaction(self, interaction_id: int):
+        """Enabled interactions of the active event come from the cache, others from the DB"""
+        event = self.get()
+        interaction = event.get_interaction(interaction_id) if event else None
+        if interaction is None:
+            interaction = await run_in_session(lambda db: db.query(Interaction).filter(Interaction.id == interaction_id).first())
+        return interaction
+
+    def invalidate(self):
+        with self._lock:
+            self._event = None
+            self._loaded = False
+
+    def _query_interactions(self, db: Session, event: Event) -> List[CachedInteraction]:
+        rows = db.query(Interaction)\
+            .filter(Interaction.event_id == event.id, Interaction.is_enabled == True)\
+            .all()
+        return [CachedInteraction(row) for row in rows]
+
+    def _set(self, event: Optional[Event], interactions: List[CachedInteraction]):
+        with self._lock:
+            self._event = CachedEvent(event, interactions) if event else None
+            self._loaded = True
+
+class ParticipantCounter:
+    """
+    Participant counts per event, split by role.
+
+    Each event's counts are loaded once with a single GROUP BY and then
+    maintained by increment() after every committed insert, so status
+    polls and stats broadcasts never run COUNT(*) over the roster.
+
+    A load also records the highest participant id it saw. SQLite commits
+    inserts one at a time in id order, so that snapshot holds exactly the
+    rows up to this watermark. increment() ignores ids at or below it
+    (already counted). Increments that arrive while a load is running are
+    kept and applied on top of that load's snapshot, so a sign-in rush
+    during the first load is neither lost nor counted twice.
+    """
+
+    def __init__(self):
+        self._counts: Dict[int, Dict[str, int]] = {}
+        self._watermarks: Dict[int, int] = {}  # event_id -> highest participant id in _counts
+        self._loading: Dict[int, int] = {}  # event_id -> loads in progress
+        self._pending: Dict[int, List[Tuple[int, str]]] = {}  # (participant_id, role) seen during a load
+        self._lock = threading.Lock()
+
+    def by_role(self, event_id: int, db: Session = None) -> Dict[str, int]:
+        if event_id not in self._counts:
+            self.load(event_id, db)
+        return dict(self._counts.get(event_id, {}))
+
+    def total(self, event_id: int, db: Session = None) -> int:
+        return sum(self.by_role(event_id, db).values())
+
+    def load(self, event_id: int, db: Session = None):
+        with self._lock:
+            self._loading[event_id] = self._loading.get(event_id, 0) + 1
+            self._pending.setdefault(event_id, [])
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        rows = None
+        try:
+            # Counts and watermark come from one statement, i.e. one snapshot
+            rows = db.query(Participant.role, func.count(Participant.id), func.max(Participant.id))\
+                .filter(Participant.event_id == event_id)\
+                .group_by(Participant.role)\
+                .all()
+        finally:
+            if own_session:
+                db.close()
+            with self._lock:
+                if rows is not None:
+                    self._install(event_id, rows)
+                self._loading[event_id] -= 1
+                if not self._loading[event_id]:
+                    del self._loading[event_id]
+                    self._pending.pop(event_id, None)
+
+    def _install(self, event_id: int, rows):
+        watermark = max((max_id for _, _, max_id in rows), default=0)
+        if event_id in self._counts and self._watermarks.get(event_id, 0) > watermark:
+            # An overlapping load already installed a newer snapshot
+            return
+        counts = {}
+        for role, count, _ in rows:
+            counts[role or "user"] = counts.get(role or "user", 0) + count
+        for participant_id, role in self._pending.get(event_id, ()):
+            if participant_id > watermark:
+                counts[role] = counts.get(role, 0) + 1
+        self._counts[event_id] = counts
+        self._watermarks[event_id] = watermark
+
+    def increment(self, event_id: int, participant_id: int, role: str = "user"):
+        """Call after a new Participant row has been committed"""
+        self._increment(event_id, participant_id, role)
+        bus.publish("participants", {"event_id": event_id, "participant_id": participant_id, "role": role})
+
+    def _from_bus(self, payload: dict):
+        self._increment(payload["event_id"], payload["participant_id"], payload["role"])
+
+    def _increment(self, event_id: int, participant_id: int, role: str):
+        with self._lock:
+            pending = self._pending.get(event_id)
+            if pending is not None:
+                # A load is running: its snapshot may or may not contain this row
+                pending.append((participant_id, role))
+            counts = self._counts.get(event_id)
+            if counts is None:
+                # Not loaded yet: the running or next load includes this row
+                return
+            if participant_id <= self._watermarks.get(event_id, 0):
+                # Already part of the loaded snapshot
+                return
+            counts[role] = counts.get(role, 0) + 1
+
+    def invalidate(self, event_id: int = None):
+        with self._lock:
+            if event_id is None:
+                self._counts.clear()
+                self._watermarks.clear()
+            else:
+                self._counts.pop(event_id, None)
+                self._watermarks.pop(event_id, None)
+
+active_event_cache = ActiveEventCache()
+participant_counter = ParticipantCounter()
+bus.subscribe("event", active_event_cache._from_bus)
+bus.subscribe("participants", participant_counter._from_bus)
+# Changes made while cut off from the other workers were missed: reread them
+bus.on_connect(lambda: run_sync(active_event_cache.load))
+bus.on_connect(participant_counter.invalidate)
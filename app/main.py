@@ -1,14 +1,25 @@
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
+import json
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from app.database import engine, Base
-from app.websockets import manager
+from app.database import engine, Base, run_sync
+from app.event_cache import active_event_cache, participant_counter
+from app.websockets import manager, encode_message
+from app.broadcast import bus
+from app.submissions import submission_writer
+from app.plugin_state import plugin_state
+from app.metrics import MetricsMiddleware, registry
 
-# Create tables
+# Create tables, then bring existing databases up to the current schema
 import app.models
+from app.migrations import run_migrations
 Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 app = FastAPI(title="互动培训系统")
+# Request counts, latency and DB queries per route template, served at /metrics
+app.add_middleware(MetricsMiddleware)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
@@ -18,10 +29,35 @@ templates = Jinja2Templates(directory="app/templates")
 
 # Load plugins
 from app.plugin_manager import plugin_manager
+from app.plugin_watcher import PluginWatcher, HOT_RELOAD
+plugin_watcher = PluginWatcher(plugin_manager)
 
 @app.on_event("startup")
 async def startup_event():
     plugin_manager.load_plugins()
+    # Warm the active event caches so request handlers never load them on the event loop
+    event = await run_sync(active_event_cache.load)
+    if event:
+        await run_sync(participant_counter.load, event.id)
+        # Plugins are imported on first use; import the active event's ones up front,
+        # the running interaction's first
+        current = event.get_interaction(event.current_interaction_id)
+        plugin_ids = [current.plugin_id] if current else []
+        plugin_ids += [i.plugin_id for i in event.interactions if i.plugin_id not in plugin_ids]
+        await run_sync(plugin_manager.preload, plugin_ids)
+    manager.start_heartbeat()
+    # Cross-worker broadcasts and cache invalidations (no-op with a single worker)
+    await bus.start()
+    if HOT_RELOAD:
+        plugin_watcher.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await plugin_watcher.stop()
+    await manager.stop_heartbeat()
+    await bus.stop()
+    await submission_writer.flush()
+    await plugin_state.checkpoint()
 
 # Mount plugins static
 import os
@@ -37,18 +73,49 @@ app.include_router(mobile.router)
 app.include_router(admin.router)
 # app.include_router(plugin_router)
 
+async def send_results_resync(client, data: str):
+    """A display missed a plugin_update sequence number: send it the full results"""
+    try:
+        message = json.loads(data)
+        interaction_id = int(message.get("interaction_id") or 0)
+    except (ValueError, TypeError, AttributeError):
+        return
+    if message.get("type") != "resync" or not interaction_id:
+        return
+    # Live results only exist for interactions of the active event
+    event = active_event_cache.get()
+    interaction = event.get_interaction(interaction_id) if event else None
+    plugin = await plugin_manager.load_plugin(interaction.plugin_id) if interaction else None
+    if plugin:
+        snapshot = await plugin.resync_message(interaction.event_id, interaction_id)
+        client.enqueue(encode_message(snapshot))
+
 @app.websocket("/ws/{role}")
 async def websocket_endpoint(websocket: WebSocket, role: str):
-    await manager.connect(websocket, role)
+    client = await manager.connect(websocket, role)
     try:
         while True:
-            # Keep alive and listen for messages (e.g. from host)
+            # Any message (normally the {"type": "pong"} heartbeat reply) proves the client is alive
             data = await websocket.receive_text()
-            # Echo or process (Simple ping/pong or logic)
-            # await manager.broadcast(f"Client says: {data}")
-    except WebSocketDisconnect:
+            client.mark_alive()
+            if '"resync"' in data:
+                await send_results_resync(client, data)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
         manager.disconnect(websocket, role)
 
+@app.get("/api/ws/connections")
+async def websocket_connections():
+    """Live WebSocket connection count per role"""
+    counts = manager.connection_counts()
+    return {"total": sum(counts.values()), "roles": counts}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus text exposition of this worker's metrics"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 # @app.get("/")
 # async def root(request: Request):
 #    return templates.TemplateResponse("index.html", {"request": request})
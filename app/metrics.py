@@ -0,0 +1,341 @@
+"""
+Prometheus-style metrics, rendered by GET /metrics in the text exposition format.
+
+No client library is needed: counters and histograms are plain dicts
+guarded by a lock (updates come from the event loop and the DB threads),
+so recording a sample costs about a microsecond. Values owned by other
+modules (connection counts, fan-out totals) are read when /metrics is
+scraped. Set METRICS_ENABLED=0 to turn the request middleware and the
+query counters off.
+
+Each HTTP request also gets a query profile: statements, DB time and
+commits, with slow statements logged (DB_SLOW_QUERY_MS) and statements
+repeated within one request flagged as likely N+1 loops
+(DB_REPEAT_THRESHOLD). Recent profiles are kept for
+GET /api/admin/queries and, with DB_DEBUG_HEADER=1, summarised in
+X-DB-Stats / Server-Timing response headers.
+"""
+import contextvars
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+# Statements slower than this are logged with their parameters (milliseconds)
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "100"))
+# The same statement this many times in one request is reported as a probable N+1 loop
+REPEAT_THRESHOLD = int(os.getenv("DB_REPEAT_THRESHOLD", "5"))
+# Add X-DB-Stats and Server-Timing headers to every response
+DEBUG_HEADER = os.getenv("DB_DEBUG_HEADER", "0") == "1"
+# Query profiles of the latest requests kept for the admin view
+RECENT_REQUESTS = int(os.getenv("DB_RECENT_REQUESTS", "100"))
+
+# Seconds; covers a cached status poll up to a slow get_results over a big interaction
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in items]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (non-cumulative, last one is +Inf), sum, count]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(series[0]), series[1], series[2]) for key, series in self._series.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+class Collected:
+    """A gauge or counter whose samples are read from elsewhere at scrape time"""
+
+    def __init__(self, name: str, help: str, kind: str, labels: Iterable[str], collect: Callable[[], Iterable[Tuple[Tuple, float]]]):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.label_names = tuple(labels)
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in self.collect()]
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collected(self, name: str, help: str, kind: str = "gauge", labels: Iterable[str] = ()):
+        """Decorator registering collect() -> [(label values, value), ...]"""
+        def register(collect):
+            self.register(Collected(name, help, kind, labels, collect))
+            return collect
+        return register
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {_escape(e)}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+http_requests = registry.counter("http_requests_total", "HTTP requests by route template and status", ("method", "route", "status"))
+http_duration = registry.histogram("http_request_duration_seconds", "HTTP request latency by route template", ("method", "route"))
+ws_fanout_duration = registry.histogram("ws_fanout_duration_seconds", "Time to queue one broadcast for all its sockets", ("type",))
+plugin_handle_input = registry.histogram("plugin_handle_input_seconds", "Plugin handle_input duration", ("plugin_id",))
+plugin_get_results = registry.histogram("plugin_get_results_seconds", "Plugin get_results duration", ("plugin_id",))
+db_queries = registry.counter("db_queries_total", "SQL statements executed")
+db_commits = registry.counter("db_commits_total", "Transactions committed")
+db_query_duration = registry.histogram("db_query_duration_seconds", "SQL statement execution time")
+db_slow_queries = registry.counter("db_slow_queries_total", "Statements slower than DB_SLOW_QUERY_MS")
+db_repeated_statements = registry.counter("db_repeated_statements_total", "Statements run DB_REPEAT_THRESHOLD or more times in one request", ("route",))
+db_queries_per_request = registry.histogram("db_queries_per_request", "SQL statements per HTTP request", ("route",), COUNT_BUCKETS)
+db_commits_per_request = registry.histogram("db_commits_per_request", "Commits per HTTP request", ("route",), COUNT_BUCKETS)
+db_time_per_request = registry.histogram("db_time_per_request_seconds", "Time spent in SQL statements per HTTP request", ("route",))
+
+class RequestStats:
+    """What one HTTP request did, collected through a context variable"""
+    __slots__ = ("scope", "queries", "commits", "db_time", "statements", "slow")
+
+    def __init__(self, scope: dict = None):
+        self.scope = scope or {}
+        self.queries = 0
+        self.commits = 0
+        self.db_time = 0.0
+        # statement text -> [executions, seconds]; the SQL is parameterised, so an N+1 loop repeats one key
+        self.statements: Dict[str, list] = {}
+        self.slow: List[dict] = []
+
+    def repeated(self) -> List[Tuple[str, int]]:
+        return [(sql, entry[0]) for sql, entry in self.statements.items() if entry[0] >= REPEAT_THRESHOLD]
+
+    def header(self) -> str:
+        return f"queries={self.queries}; commits={self.commits}; db_ms={self.db_time * 1000:.1f}; repeated={len(self.repeated())}; slow={len(self.slow)}"
+
+# Set by the middleware; database work on the DB threads runs in a copy of the request's context
+current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("current_request", default=None)
+
+# Query profiles of the latest requests that touched the database, newest last
+recent_requests = deque(maxlen=RECENT_REQUESTS)
+
+def _short(value, limit: int = 500) -> str:
+    text = repr(value) if not isinstance(value, str) else " ".join(value.split())
+    return text if len(text) <= limit else text[:limit] + "..."
+
+def record_query(statement: str, parameters, elapsed: float):
+    db_queries.inc()
+    db_query_duration.observe(elapsed)
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+        entry = stats.statements.get(statement)
+        if entry is None:
+            stats.statements[statement] = [1, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        db_slow_queries.inc()
+        route = route_template(stats.scope) if stats is not None else "background"
+        logger.warning(f"Slow query ({elapsed * 1000:.1f}ms) in {route}: {_short(statement)} parameters={_short(parameters)}")
+        if stats is not None:
+            stats.slow.append({"sql": _short(statement), "parameters": _short(parameters), "ms": round(elapsed * 1000, 2)})
+
+def record_commit():
+    db_commits.inc()
+    stats = current_request.get()
+    if stats is not None:
+        stats.commits += 1
+
+def finish_request(stats: RequestStats, method: str, route: str, status: int, elapsed: float):
+    """Per-request query metrics, N+1 warnings and the admin view's profile"""
+    db_queries_per_request.observe(stats.queries, route)
+    db_commits_per_request.observe(stats.commits, route)
+    db_time_per_request.observe(stats.db_time, route)
+    if not stats.queries and not stats.commits:
+        return
+    repeated = stats.repeated()
+    for sql, count in repeated:
+        db_repeated_statements.inc(route)
+        logger.warning(f"Possible N+1 in {method} {route}: statement ran {count} times: {_short(sql, 300)}")
+    top = sorted(stats.statements.items(), key=lambda item: item[1][1], reverse=True)[:10]
+    recent_requests.append({
+        "time": time.strftime("%H:%M:%S"),
+        "method": method,
+        "route": route,
+        "path": stats.scope.get("path"),
+        "status": status,
+        "duration_ms": round(elapsed * 1000, 2),
+        "queries": stats.queries,
+        "commits": stats.commits,
+        "db_ms": round(stats.db_time * 1000, 2),
+        "repeated": [{"sql": _short(sql, 300), "count": count} for sql, count in repeated],
+        "slow": stats.slow,
+        "statements": [{"sql": _short(sql, 300), "count": count, "ms": round(seconds * 1000, 2)} for sql, (count, seconds) in top],
+    })
+
+def route_template(scope: dict) -> str:
+    """The route's path template (/api/plugin/{interaction_id}/submit), never the raw path"""
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return route.path
+    root_path = scope.get("root_path")
+    if root_path:
+        # Mounted apps (static files): one series per mount
+        return root_path + "/*"
+    return "unmatched"
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: latency, status and query counts per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = current_request.set(stats)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if DEBUG_HEADER:
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [
+                        (b"x-db-stats", stats.header().encode("latin-1")),
+                        (b"server-timing", f"db;dur={stats.db_time * 1000:.1f};desc=\"{stats.queries} queries\"".encode("latin-1")),
+                    ]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_request.reset(token)
+            route = route_template(scope)
+            method = scope.get("method", "GET")
+            http_requests.inc(method, route, str(status[0]))
+            http_duration.observe(elapsed, method, route)
+            finish_request(stats, method, route, status[0], elapsed)
+
+def timed_hook(histogram: Histogram):
+    """Wrap an async plugin hook so its duration is observed per plugin_id"""
+    def decorate(func):
+        @wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(self, *args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, self.plugin_id)
+        wrapper._metrics_timed = True
+        return wrapper
+    return decorate
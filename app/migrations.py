@@ -0,0 +1,100 @@
+"""
+Versioned schema migrations for app.db.
+
+The schema version is kept in SQLite's PRAGMA user_version. On startup
+every migration newer than that version runs in order, each one in its
+own transaction, and the version is bumped after it. Migrations must be
+idempotent: a fresh database already gets the current schema from
+create_all() and only has its version stamped.
+
+To change the schema, add a model change plus a new @migration with the
+next version number; never edit a migration that has been released.
+"""
+from typing import Callable, List, Tuple
+from sqlalchemy.engine import Connection, Engine
+from app.database import engine as default_engine
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = []
+
+def migration(version: int, description: str):
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return register
+
+def table_exists(conn: Connection, table: str) -> bool:
+    return conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).first() is not None
+
+def add_column_if_missing(conn: Connection, table: str, column: str, ddl: str):
+    if not table_exists(conn, table):
+        return
+    columns = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        print(f"Adding {column} column to {table} table...")
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+@migration(1, "columns previously added by update_db.py")
+def add_legacy_columns(conn: Connection):
+    # events.custom_plugins was dropped from the model and is no longer added
+    add_column_if_missing(conn, "events", "current_interaction_id", "INTEGER")
+    add_column_if_missing(conn, "participants", "interaction_count", "INTEGER DEFAULT 0")
+
+@migration(2, "composite indexes for hot lookups")
+def add_lookup_indexes(conn: Connection):
+    # The plugin_submissions unique index is built by migration 3, once rows carry their
+    # interaction id; deduplicating per plugin here would drop earlier interactions' answers
+    if table_exists(conn, "participants"):
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_participants_event_name_role "
+            "ON participants (event_id, name, role)"
+        )
+    if table_exists(conn, "events"):
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_events_is_active ON events (is_active)")
+
+@migration(3, "plugin_submissions.interaction_id")
+def add_submission_interaction_id(conn: Connection):
+    if not table_exists(conn, "plugin_submissions"):
+        return
+    add_column_if_missing(conn, "plugin_submissions", "interaction_id", "INTEGER REFERENCES interactions (id)")
+    # Submissions used to carry their interaction inside the JSON blob
+    conn.exec_driver_sql("""
+        UPDATE plugin_submissions
+        SET interaction_id = CAST(json_extract(data, '$._interaction_id') AS INTEGER)
+        WHERE interaction_id IS NULL AND json_valid(data) AND json_extract(data, '$._interaction_id') IS NOT NULL
+    """)
+    # A user may now have one submission per interaction instead of one per plugin
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ux_plugin_submissions_event_plugin_user")
+    conn.exec_driver_sql("""
+        DELETE FROM plugin_submissions WHERE interaction_id IS NOT NULL AND id NOT IN (
+            SELECT MAX(id) FROM plugin_submissions WHERE interaction_id IS NOT NULL GROUP BY interaction_id, user_id
+        )
+    """)
+    conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_plugin_submissions_interaction_user "
+        "ON plugin_submissions (interaction_id, user_id)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_plugin_submissions_event_plugin "
+        "ON plugin_submissions (event_id, plugin_id)"
+    )
+
+def schema_version(engine: Engine = default_engine) -> int:
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA user_version").scalar() or 0
+
+def run_migrations(engine: Engine = default_engine) -> int:
+    """Apply all pending migrations and return the resulting schema version"""
+    current = schema_version(engine)
+    for version, description, func in MIGRATIONS:
+        if version <= current:
+            continue
+        print(f"Applying migration {version}: {description}")
+        with engine.begin() as conn:
+            func(conn)
+            # PRAGMA does not take bound parameters; version is an int from this module
+            conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+        current = version
+    return current
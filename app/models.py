@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Text, JSON
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Text, JSON, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -12,7 +12,7 @@ class Event(Base):
     host_password_hash = Column(String) # Store hashed password
     admin_password_hash = Column(String, default="admin123") # Admin panel password
     logo_url = Column(String, nullable=True) # URL or Base64
-    is_active = Column(Boolean, default=True)
+    is_active = Column(Boolean, default=True, index=True)
     status = Column(String, default="pending") # pending, running, ended
     
     # State management
@@ -52,6 +52,11 @@ class Participant(Base):
     
     event = relationship("Event")
 
+    __table_args__ = (
+        # Re-sign-in lookup; not unique because hosts may sign in several times under one name
+        Index("ix_participants_event_name_role", "event_id", "name", "role"),
+    )
+
 class Plugin(Base):
     __tablename__ = "plugins"
 
@@ -67,6 +72,23 @@ class PluginSubmission(Base):
     id = Column(Integer, primary_key=True, index=True)
     event_id = Column(Integer, ForeignKey("events.id"))
     plugin_id = Column(String, ForeignKey("plugins.id"))
+    interaction_id = Column(Integer, ForeignKey("interactions.id"), nullable=True) # NULL for rows older than this column
     user_id = Column(Integer, ForeignKey("participants.id"))
     data = Column(JSON) # User submission data
     created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # One submission per user and interaction; the target of the upsert's ON CONFLICT
+        Index("ux_plugin_submissions_interaction_user", "interaction_id", "user_id", unique=True),
+        Index("ix_plugin_submissions_event_plugin", "event_id", "plugin_id"),
+    )
+
+class PluginState(Base):
+    __tablename__ = "plugin_states"
+
+    # Runtime state of one interaction (e.g. a game's generated numbers), checkpointed by app/plugin_state.py
+    interaction_id = Column(Integer, ForeignKey("interactions.id"), primary_key=True)
+    plugin_id = Column(String, ForeignKey("plugins.id"))
+    data = Column(JSON)
+    version = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
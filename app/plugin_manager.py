@@ -1,117 +1,409 @@
 import importlib
 import os
 import json
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from abc import ABC, abstractmethod
 from fastapi import APIRouter
 from fastapi.templating import Jinja2Templates
-from app.models import Plugin as PluginModel
-from app.database import SessionLocal
+from typing import Dict, Optional
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.models import Plugin as PluginModel, Interaction
+from app.event_cache import active_event_cache
+from app.database import SessionLocal, run_sync, run_in_session
+from app.submissions import SubmissionStore
+from app.plugin_state import plugin_state
+from app.results_cache import results_cache
+from app.results_delta import results_stream
+from app.websockets import manager
+from app import metrics
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of rendered plugin fragments kept in memory
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "256"))
+
+def config_hash(config: dict, name: str = None) -> str:
+    """Stable hash of everything from an interaction that a fragment renders"""
+    payload = json.dumps({"config": config or {}, "name": name}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+def read_manifest(path: str, plugin_id: str) -> dict:
+    manifest_path = os.path.join(path, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"name": plugin_id, "description": ""}
+
+class PluginManifest:
+    """What is known about a plugin before its code is imported"""
+    __slots__ = ("plugin_id", "path", "meta")
+
+    def __init__(self, plugin_id: str, path: str):
+        self.plugin_id = plugin_id
+        self.path = path
+        self.meta = read_manifest(path, plugin_id)
+
+    @property
+    def name(self):
+        return self.meta.get("name", self.plugin_id)
+
 class BasePlugin(ABC):
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Time the plugin's own hooks per plugin_id for /metrics
+        for hook, histogram in (("handle_input", metrics.plugin_handle_input), ("get_results", metrics.plugin_get_results)):
+            func = cls.__dict__.get(hook)
+            if func is not None and not getattr(func, "_metrics_timed", False):
+                setattr(cls, hook, metrics.timed_hook(histogram)(func))
+
     def __init__(self, plugin_id: str, path: str):
         self.plugin_id = plugin_id
         self.path = path
         self.meta = {}
         self.load_metadata()
+        # Interaction-scoped access to this plugin's submissions
+        self.submissions = SubmissionStore(plugin_id)
 
     def load_metadata(self):
-        manifest_path = os.path.join(self.path, "manifest.json")
-        if os.path.exists(manifest_path):
-            with open(manifest_path, "r", encoding="utf-8") as f:
-                self.meta = json.load(f)
-        else:
-            self.meta = {"name": self.plugin_id, "description": ""}
+        self.meta = read_manifest(self.path, self.plugin_id)
 
     @property
     def name(self):
         return self.meta.get("name", self.plugin_id)
 
+    async def run_db(self, func, *args, **kwargs):
+        """
+        Run func(db, *args, **kwargs) with a fresh session on the DB thread pool.
+
+        Plugin hooks are coroutines on the server's only event loop; database
+        work must go through here so it never blocks WebSocket traffic.
+        """
+        return await run_in_session(func, *args, **kwargs)
+
+    async def get_interaction_config(self, interaction_id: Optional[int]) -> dict:
+        """Config of the interaction (cached for the active event), falling back to the manifest config"""
+        if interaction_id:
+            event = active_event_cache.get()
+            interaction = event.get_interaction(interaction_id) if event else None
+            if interaction is None:
+                interaction = await self.run_db(lambda db: db.query(Interaction).filter(Interaction.id == interaction_id).first())
+            if interaction and interaction.plugin_id == self.plugin_id and interaction.config:
+                return dict(interaction.config)
+        return self.meta.get("config", {})
+
+    async def get_cached_results(self, event_id: int, interaction_id: Optional[int]) -> dict:
+        """get_results() served from the per-interaction snapshot cache"""
+        snapshot = await results_cache.get(self, event_id, interaction_id)
+        return snapshot.results
+
+    def publish_results(self, event_id: int, interaction_id: int):
+        """
+        Push the interaction's results to the displays as a plugin_update.
+
+        Coalesced per interaction and delta-encoded against what the displays
+        already have (see app/results_delta.py); call after every accepted input.
+        """
+        manager.publish(f"results:{interaction_id}", lambda: self._results_update(event_id, interaction_id))
+
+    async def _results_update(self, event_id: int, interaction_id: int) -> Optional[dict]:
+        results = await self.get_cached_results(event_id, interaction_id)
+        return results_stream.encode(self.plugin_id, interaction_id, results)
+
+    async def resync_message(self, event_id: int, interaction_id: int) -> dict:
+        """Full plugin_update for a client that missed a sequence number"""
+        results = None
+        if not results_stream.has_stream(interaction_id):
+            results = await self.get_cached_results(event_id, interaction_id)
+        return results_stream.snapshot(self.plugin_id, interaction_id, results)
+
+    async def load_state(self, interaction_id: int) -> dict:
+        """
+        Runtime state of one interaction (e.g. generated game data); {} if none.
+
+        Served from memory after the first read, shared by all workers and
+        checkpointed to the database (see app/plugin_state.py). Read-only:
+        change it with save_state() / update_state().
+        """
+        return await plugin_state.load(interaction_id) or {}
+
+    async def save_state(self, interaction_id: int, data: dict, durable: bool = False):
+        await plugin_state.save(self.plugin_id, interaction_id, data, durable=durable)
+
+    async def update_state(self, interaction_id: int, durable: bool = False, **changes) -> dict:
+        return await plugin_state.update(self.plugin_id, interaction_id, durable=durable, **changes)
+
+    def reloaded_from(self, previous: "BasePlugin"):
+        """
+        Called on hot reload with the instance being replaced, before the swap.
+        Override to carry over in-memory state; by default nothing is kept.
+        """
+        pass
+
     @abstractmethod
-    async def start(self, event_id: int):
+    async def start(self, event_id: int, interaction_id: int):
         pass
 
     @abstractmethod
-    async def stop(self, event_id: int):
+    async def stop(self, event_id: int, interaction_id: int):
         pass
     
     @abstractmethod
-    async def handle_input(self, event_id: int, user_id: int, data: dict):
+    async def handle_input(self, event_id: int, interaction_id: int, user_id: int, data: dict):
         pass
 
     @abstractmethod
-    async def get_results(self, event_id: int) -> dict:
+    async def get_results(self, event_id: int, interaction_id: Optional[int]) -> dict:
         pass
 
 class PluginManager:
+    """
+    Registry of the plugins in plugin_dir.
+
+    Startup only reads the manifest.json files and upserts the plugins
+    table in one transaction. A plugin's code and templates are imported
+    the first time it is needed (load_plugin, i.e. when an interaction
+    using it is started, submitted to or rendered), so startup cost does
+    not grow with the number of installed plugins. The import runs on the
+    DB thread pool, never on the event loop.
+    """
+
     def __init__(self, plugin_dir: str = "plugins"):
         self.plugin_dir = plugin_dir
-        self.plugins = {}
+        self.manifests: Dict[str, PluginManifest] = {}
+        self.plugins = {} # plugin_id -> BasePlugin, only the imported ones
         self.templates = {} # plugin_id -> Jinja2Templates
+        self._failed = set() # plugin_ids whose import failed, retried after a reload
+        self._load_lock = threading.Lock()
+        # Milliseconds spent per plugin: manifest scan at startup, import on first use
+        self.load_stats: Dict[str, dict] = {}
+        # Rendered HTML of plugin templates, LRU:
+        # (plugin_id, template, interaction_id, config_hash, role, extra) -> str
+        self._fragments = OrderedDict()
+        self._fragments_lock = threading.Lock()
+        self.fragment_stats = {"hits": 0, "misses": 0, "invalidations": 0}
 
     def load_plugins(self):
         logger.info(f"Scanning plugins in {self.plugin_dir}...")
         if not os.path.exists(self.plugin_dir):
             os.makedirs(self.plugin_dir)
-            
-        for name in os.listdir(self.plugin_dir):
+
+        started = time.perf_counter()
+        for name in sorted(os.listdir(self.plugin_dir)):
             plugin_path = os.path.join(self.plugin_dir, name)
             if os.path.isdir(plugin_path) and os.path.exists(os.path.join(plugin_path, "plugin.py")):
+                scan_started = time.perf_counter()
                 try:
-                    # Import module
-                    spec = importlib.util.spec_from_file_location(f"plugins.{name}", os.path.join(plugin_path, "plugin.py"))
-                    module = importlib.util.module_from_spec(spec)
-                    spec.loader.exec_module(module)
-                    
-                    # Find Plugin class
-                    if hasattr(module, "Plugin"):
-                        plugin_instance = module.Plugin(name, plugin_path)
-                        self.plugins[name] = plugin_instance
-                        
-                        # Setup templates
-                        template_dir = os.path.join(plugin_path, "templates")
-                        if os.path.isdir(template_dir):
-                            tmpl = Jinja2Templates(directory=template_dir)
-                            tmpl.env.filters["tojson"] = json.dumps
-                            self.templates[name] = tmpl
-                            
-                        logger.info(f"Loaded plugin: {name}")
-                        
-                        # Sync to DB
-                        self.sync_to_db(plugin_instance)
+                    self.manifests[name] = PluginManifest(name, plugin_path)
                 except Exception as e:
-                    logger.error(f"Failed to load plugin {name}: {e}")
+                    logger.error(f"Failed to read manifest of plugin {name}: {e}")
+                    continue
+                self._record(name, "scan_ms", scan_started)
+                logger.info(f"Registered plugin: {name} ({self.load_stats[name]['scan_ms']} ms)")
+
+        # Sync to DB
+        self.sync_registry(list(self.manifests.values()))
+        logger.info(f"Registered {len(self.manifests)} plugins in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    def preload(self, plugin_ids):
+        """Import the given plugins now (e.g. the active interaction's, at startup)"""
+        for plugin_id in plugin_ids:
+            self.get_plugin(plugin_id)
+
+    def _ensure_loaded(self, plugin_id: str) -> Optional[BasePlugin]:
+        plugin = self.plugins.get(plugin_id)
+        if plugin is not None or plugin_id not in self.manifests or plugin_id in self._failed:
+            return plugin
+        with self._load_lock:
+            plugin = self.plugins.get(plugin_id)
+            if plugin is not None or plugin_id in self._failed:
+                return plugin
+            manifest = self.manifests.get(plugin_id)
+            if manifest is None:
+                return None
+            started = time.perf_counter()
+            try:
+                plugin, tmpl = self._build_plugin(plugin_id, manifest.path)
+            except Exception as e:
+                logger.error(f"Failed to load plugin {plugin_id}: {e}")
+                plugin = None
+            if plugin is None:
+                self._failed.add(plugin_id)
+                return None
+            self._install(plugin_id, plugin, tmpl)
+            self._record(plugin_id, "import_ms", started)
+            logger.info(f"Loaded plugin: {plugin_id} ({self.load_stats[plugin_id]['import_ms']} ms)")
+            return plugin
 
-    def sync_to_db(self, plugin: BasePlugin):
+    def _record(self, plugin_id: str, key: str, started: float):
+        self.load_stats.setdefault(plugin_id, {})[key] = round((time.perf_counter() - started) * 1000, 3)
+
+    def reload_plugin(self, name: str) -> bool:
+        """
+        Re-read one plugin directory (manifest, and module and templates if
+        the plugin was already imported) in place.
+
+        The new instance is fully built before it replaces the old one, so
+        requests see either the old or the new plugin, never a half-loaded
+        one; if anything fails the old version stays active. Other plugins
+        and open WebSockets are not touched. A removed directory unloads
+        the plugin.
+        """
+        plugin_path = os.path.join(self.plugin_dir, name)
+        if not os.path.exists(os.path.join(plugin_path, "plugin.py")):
+            self.manifests.pop(name, None)
+            self._failed.discard(name)
+            if self.plugins.pop(name, None):
+                self.templates.pop(name, None)
+                logger.info(f"Unloaded plugin: {name}")
+            self.invalidate_fragments(plugin_id=name)
+            return False
+
+        with self._load_lock:
+            try:
+                manifest = PluginManifest(name, plugin_path)
+                previous = self.plugins.get(name)
+                plugin_instance, tmpl = None, None
+                if previous is not None:
+                    plugin_instance, tmpl = self._build_plugin(name, plugin_path)
+                    if not plugin_instance:
+                        return False
+            except Exception as e:
+                logger.error(f"Failed to reload plugin {name}, keeping the previous version: {e}")
+                return False
+
+            self.manifests[name] = manifest
+            self._failed.discard(name)
+            if plugin_instance is None:
+                # Not imported yet: the new code is picked up on first use
+                self.invalidate_fragments(plugin_id=name)
+            else:
+                try:
+                    plugin_instance.reloaded_from(previous)
+                except Exception as e:
+                    logger.warning(f"Plugin {name} could not take over its previous state: {e}")
+                self._install(name, plugin_instance, tmpl)
+        self.sync_registry([manifest])
+        logger.info(f"{'Reloaded' if previous else 'Registered'} plugin: {name}")
+        return True
+
+    def _build_plugin(self, name: str, plugin_path: str):
+        """Import plugin.py and prepare its templates without registering anything"""
+        # Import module (a fresh module object every time, so reloads pick up code changes)
+        spec = importlib.util.spec_from_file_location(f"plugins.{name}", os.path.join(plugin_path, "plugin.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        
+        # Find Plugin class
+        if not hasattr(module, "Plugin"):
+            return None, None
+        plugin_instance = module.Plugin(name, plugin_path)
+        
+        # Setup templates
+        tmpl = None
+        template_dir = os.path.join(plugin_path, "templates")
+        if os.path.isdir(template_dir):
+            tmpl = Jinja2Templates(directory=template_dir)
+            tmpl.env.filters["tojson"] = json.dumps
+        return plugin_instance, tmpl
+
+    def _install(self, name: str, plugin_instance: BasePlugin, tmpl):
+        # Plain dict assignments: the swap is atomic for every request
+        if tmpl is not None:
+            self.templates[name] = tmpl
+        else:
+            self.templates.pop(name, None)
+        self.plugins[name] = plugin_instance
+        self.invalidate_fragments(plugin_id=name)
+
+    def sync_registry(self, plugins):
+        """
+        Upsert the plugins table rows of the given manifests (or plugins) in one transaction.
+
+        Name and description follow the manifest; the config is only written
+        for new rows, so configs edited in the database are kept.
+        """
+        if not plugins:
+            return
+        stmt = sqlite_insert(PluginModel)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[PluginModel.id],
+            set_={"name": stmt.excluded.name, "description": stmt.excluded.description}
+        )
+        rows = [{
+            "id": plugin.plugin_id,
+            "name": plugin.name,
+            "description": plugin.meta.get("description"),
+            "config": plugin.meta.get("config", {})
+        } for plugin in plugins]
         db = SessionLocal()
         try:
-            db_plugin = db.query(PluginModel).filter(PluginModel.id == plugin.plugin_id).first()
-            if not db_plugin:
-                db_plugin = PluginModel(
-                    id=plugin.plugin_id,
-                    name=plugin.name,
-                    description=plugin.meta.get("description"),
-                    config=plugin.meta.get("config", {})
-                )
-                db.add(db_plugin)
-            else:
-                db_plugin.name = plugin.name
-                db_plugin.description = plugin.meta.get("description")
-                # db_plugin.config = plugin.meta.get("config", {}) # Don't overwrite config if modified
+            db.execute(stmt, rows)
             db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to sync plugin registry: {e}")
         finally:
             db.close()
 
     def get_plugin(self, plugin_id: str):
-        return self.plugins.get(plugin_id)
+        """Synchronous lookup that imports on a miss; request handlers use load_plugin()"""
+        return self._ensure_loaded(plugin_id)
+
+    async def load_plugin(self, plugin_id: str):
+        """get_plugin() for the event loop: a first-use import runs on the DB thread pool"""
+        plugin = self.plugins.get(plugin_id)
+        if plugin is None and plugin_id in self.manifests and plugin_id not in self._failed:
+            plugin = await run_sync(self._ensure_loaded, plugin_id)
+        return plugin
 
     def get_templates(self, plugin_id: str):
+        if plugin_id not in self.templates:
+            self._ensure_loaded(plugin_id)
         return self.templates.get(plugin_id)
         
+    def render_fragment(self, plugin_id: str, template: str, context: dict,
+                        interaction_id: int = 0, role: str = None, extra=None) -> str:
+        """
+        Render one of a plugin's templates, or return the cached HTML.
+
+        The HTML of display/user/host pages only depends on the template,
+        the interaction and its config, and the viewer's role, so one render
+        serves every identical request. The config hash is part of the key,
+        so an edited config never hits a stale entry; `extra` adds anything
+        else the output depends on (e.g. the results version).
+        """
+        key = (plugin_id, template, interaction_id,
+               config_hash(context.get("config"), context.get("plugin_name")), role, extra)
+        with self._fragments_lock:
+            html = self._fragments.get(key)
+            if html is not None:
+                self._fragments.move_to_end(key)
+                self.fragment_stats["hits"] += 1
+                return html
+
+        plugin_templates = self.get_templates(plugin_id)
+        html = plugin_templates.get_template(template).render(context)
+        with self._fragments_lock:
+            self.fragment_stats["misses"] += 1
+            self._fragments[key] = html
+            while len(self._fragments) > FRAGMENT_CACHE_SIZE:
+                self._fragments.popitem(last=False)
+        return html
+
+    def invalidate_fragments(self, plugin_id: str = None, interaction_id: int = None):
+        """Drop cached fragments of a plugin (reloaded) and/or an interaction (config changed)"""
+        with self._fragments_lock:
+            for key in list(self._fragments):
+                if (plugin_id is None or key[0] == plugin_id) and (interaction_id is None or key[2] == interaction_id):
+                    del self._fragments[key]
+            self.fragment_stats["invalidations"] += 1
+
     def get_all_plugins(self):
-        """Return list of static plugins"""
-        return self.plugins.copy()
+        """Return the registered plugins (manifests, no code is imported)"""
+        return dict(sorted(self.manifests.items()))
 
 plugin_manager = PluginManager()
@@ -0,0 +1,173 @@
+import asyncio
+import copy
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Optional
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from app.broadcast import bus
+from app.database import run_in_session
+from app.models import PluginState
+
+logger = logging.getLogger(__name__)
+
+# Dirty states are written to SQLite at most this often (milliseconds)
+CHECKPOINT_INTERVAL_MS = int(os.getenv("PLUGIN_STATE_CHECKPOINT_MS", "1000"))
+
+class InteractionState:
+    __slots__ = ("plugin_id", "data", "version", "dirty")
+
+    def __init__(self, plugin_id: str, data: dict, version: int = 0, dirty: bool = False):
+        self.plugin_id = plugin_id
+        self.data = data
+        self.version = version
+        self.dirty = dirty
+
+class PluginStateStore:
+    """
+    Runtime state of plugins, one dict per interaction.
+
+    Reads are served from memory (a dict lookup after the first load), so
+    plugins can consult their state on every submission. Writes replace
+    the interaction's state in memory, are forwarded to the other workers
+    over the bus and written to the plugin_states table by a periodic
+    checkpoint, so the state survives a restart; save(durable=True) waits
+    for the write instead. Each write bumps the state's version and a
+    worker only applies a state newer than the one it has.
+    """
+
+    def __init__(self, checkpoint_interval_ms: int = CHECKPOINT_INTERVAL_MS):
+        self.checkpoint_interval = checkpoint_interval_ms / 1000
+        self._states: Dict[int, InteractionState] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._checkpoint_lock = asyncio.Lock()
+        self.stats = {"hits": 0, "loads": 0, "checkpoints": 0, "written": 0}
+
+    async def load(self, interaction_id: int) -> Optional[dict]:
+        """The interaction's state, or None if it has none. Treat the dict as read-only."""
+        state = self._states.get(interaction_id)
+        if state is None:
+            state = await run_in_session(self._read, interaction_id)
+            if state is None:
+                return None
+            # A save may have happened while reading; it is newer
+            state = self._states.setdefault(interaction_id, state)
+            self.stats["loads"] += 1
+        else:
+            self.stats["hits"] += 1
+        return state.data
+
+    async def save(self, plugin_id: str, interaction_id: int, data: dict, durable: bool = False):
+        """Replace the interaction's state; durable=True returns only once it is in the database"""
+        state = self._states.get(interaction_id)
+        version = state.version + 1 if state else await run_in_session(self._stored_version, interaction_id) + 1
+        self._states[interaction_id] = InteractionState(plugin_id, copy.deepcopy(data), version, dirty=True)
+        bus.publish("plugin_state", {"interaction_id": interaction_id, "plugin_id": plugin_id, "data": data, "version": version})
+        if durable:
+            await self.checkpoint()
+        else:
+            self._schedule_checkpoint()
+
+    async def update(self, plugin_id: str, interaction_id: int, durable: bool = False, **changes) -> dict:
+        """Save the current state with some keys changed; returns the new state"""
+        data = dict(await self.load(interaction_id) or {})
+        data.update(changes)
+        await self.save(plugin_id, interaction_id, data, durable=durable)
+        return data
+
+    async def clear(self, interaction_id: int):
+        self._states.pop(interaction_id, None)
+        bus.publish("plugin_state", {"interaction_id": interaction_id, "cleared": True})
+        await run_in_session(self._delete, interaction_id)
+
+    def evict(self, interaction_id: int = None):
+        """Drop in-memory copies that are already checkpointed; the next load reads the database"""
+        for key in [interaction_id] if interaction_id is not None else list(self._states):
+            state = self._states.get(key)
+            if state is not None and not state.dirty:
+                del self._states[key]
+
+    async def checkpoint(self):
+        """Write every dirty state to the database in one transaction"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._checkpoint_lock:
+            rows = []
+            for interaction_id, state in list(self._states.items()):
+                if state.dirty:
+                    state.dirty = False
+                    rows.append({
+                        "interaction_id": interaction_id,
+                        "plugin_id": state.plugin_id,
+                        "data": state.data,
+                        "version": state.version,
+                        "updated_at": datetime.utcnow()
+                    })
+            if not rows:
+                return
+            try:
+                await run_in_session(self._write, rows)
+            except Exception as e:
+                logger.error(f"Plugin state checkpoint of {len(rows)} states failed: {e}")
+                for row in rows:
+                    state = self._states.get(row["interaction_id"])
+                    if state is not None and state.version == row["version"]:
+                        state.dirty = True
+                self._schedule_checkpoint()
+                return
+            self.stats["checkpoints"] += 1
+            self.stats["written"] += len(rows)
+
+    def _schedule_checkpoint(self):
+        if self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.checkpoint_interval, lambda: asyncio.create_task(self.checkpoint()))
+
+    def _from_bus(self, payload: dict):
+        """Another worker saved or cleared a state; it also checkpoints it"""
+        interaction_id = payload["interaction_id"]
+        if payload.get("cleared"):
+            self._states.pop(interaction_id, None)
+            return
+        state = self._states.get(interaction_id)
+        if state is None or payload["version"] > state.version:
+            self._states[interaction_id] = InteractionState(payload["plugin_id"], payload["data"], payload["version"])
+
+    def _read(self, db: Session, interaction_id: int) -> Optional[InteractionState]:
+        row = db.query(PluginState).filter(PluginState.interaction_id == interaction_id).first()
+        if row is None:
+            return None
+        return InteractionState(row.plugin_id, row.data or {}, row.version or 0)
+
+    def _stored_version(self, db: Session, interaction_id: int) -> int:
+        return db.query(PluginState.version).filter(PluginState.interaction_id == interaction_id).scalar() or 0
+
+    def _write(self, db: Session, rows: list):
+        stmt = sqlite_insert(PluginState)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[PluginState.interaction_id],
+            set_={"data": stmt.excluded.data, "version": stmt.excluded.version, "updated_at": stmt.excluded.updated_at},
+            # Never overwrite a newer checkpoint written by another worker
+            where=PluginState.version < stmt.excluded.version
+        )
+        try:
+            db.execute(stmt, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+    def _delete(self, db: Session, interaction_id: int):
+        try:
+            db.query(PluginState).filter(PluginState.interaction_id == interaction_id).delete()
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+plugin_state = PluginStateStore()
+bus.subscribe("plugin_state", plugin_state._from_bus)
+# States other workers saved while cut off from them: reread (dirty local ones are kept)
+bus.on_connect(plugin_state.evict)
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+from typing import Dict, Optional, Tuple
+from app.database import run_sync
+
+logger = logging.getLogger(__name__)
+
+# 插件热加载: 轮询 plugins/ 目录, 只重新加载发生变化的插件
+HOT_RELOAD = os.getenv("PLUGIN_HOT_RELOAD", "1") != "0"
+WATCH_INTERVAL = float(os.getenv("PLUGIN_WATCH_INTERVAL", "1.0"))
+
+Fingerprint = Tuple[int, int, int]
+
+def fingerprint(path: str) -> Optional[Fingerprint]:
+    """(file count, newest mtime, total size) of a plugin directory, or None if it is gone"""
+    if not os.path.isfile(os.path.join(path, "plugin.py")):
+        return None
+    count, newest, size = 0, 0, 0
+    stack = [path]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name == "__pycache__" or entry.name.startswith("."):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            count += 1
+            newest = max(newest, st.st_mtime_ns)
+            size += st.st_size
+    return count, newest, size
+
+class PluginWatcher:
+    """
+    Reloads a plugin when files in its directory change.
+
+    Every interval the plugin directories are fingerprinted; a directory
+    whose fingerprint changed is reloaded once it has been stable for one
+    more interval (so a half-copied plugin is not imported). Only that
+    plugin is swapped, other plugins and connected clients are unaffected.
+    """
+
+    def __init__(self, plugin_manager, interval: float = WATCH_INTERVAL):
+        self.plugin_manager = plugin_manager
+        self.interval = interval
+        self._fingerprints: Dict[str, Optional[Fingerprint]] = {}
+        self._pending: Dict[str, Optional[Fingerprint]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def scan(self) -> Dict[str, Optional[Fingerprint]]:
+        plugin_dir = self.plugin_manager.plugin_dir
+        names = set(self._fingerprints)
+        if os.path.isdir(plugin_dir):
+            names.update(name for name in os.listdir(plugin_dir) if os.path.isdir(os.path.join(plugin_dir, name)))
+        return {name: fingerprint(os.path.join(plugin_dir, name)) for name in names}
+
+    async def _run(self):
+        self._fingerprints = await run_sync(self.scan)
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Plugin watcher failed: {e}")
+
+    async def check(self):
+        current = await run_sync(self.scan)
+        for name, fp in current.items():
+            if fp == self._fingerprints.get(name):
+                self._pending.pop(name, None)
+                continue
+            if name not in self._pending or self._pending[name] != fp:
+                # Changed since the last scan: wait until the directory stops changing
+                self._pending[name] = fp
+                continue
+            del self._pending[name]
+            self._fingerprints[name] = fp
+            if fp is None:
+                self._fingerprints.pop(name, None)
+            logger.info(f"Plugin {name} changed on disk, reloading")
+            # Importing and syncing the registry row happen off the event loop
+            await run_sync(self.plugin_manager.reload_plugin, name)
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import time
+from typing import Dict, Optional, Tuple
+from app.broadcast import bus
+
+class ResultsSnapshot:
+    """Results of one interaction at one version, with its ETag and encoded body"""
+    __slots__ = ("interaction_id", "version", "results", "etag", "_body")
+
+    def __init__(self, interaction_id: Optional[int], version: int, results: dict, etag: Optional[str]):
+        self.interaction_id = interaction_id
+        self.version = version
+        self.results = results
+        self.etag = etag
+        self._body = None
+
+    @property
+    def body(self) -> bytes:
+        # Encoded once per version, like JSONResponse would render it
+        if self._body is None:
+            self._body = json.dumps(self.results, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return self._body
+
+class ResultsCache:
+    """
+    Snapshot cache of plugin results, one entry per interaction.
+
+    Every accepted submission (and every start/stop/reset of an interaction)
+    bumps the interaction's version. A snapshot is only recomputed with
+    plugin.get_results() when it is older than the current version, and
+    concurrent requests for the same version share one computation. The
+    ETag includes a per-process epoch so a restarted server never answers
+    304 to a tag issued by the previous process.
+    """
+
+    def __init__(self):
+        self.epoch = f"{int(time.time() * 1000):x}"
+        self._versions: Dict[int, int] = {}
+        self._snapshots: Dict[int, ResultsSnapshot] = {}
+        self._pending: Dict[int, Tuple[int, asyncio.Future]] = {}
+        self.stats = {"hits": 0, "misses": 0, "bumps": 0}
+
+    def version(self, interaction_id: int) -> int:
+        return self._versions.get(interaction_id, 0)
+
+    def bump(self, interaction_id: Optional[int]):
+        """Call after anything that changes the interaction's results was committed"""
+        if interaction_id is None:
+            return
+        self._bump(interaction_id)
+        # Other workers drop their snapshot of this interaction too
+        bus.publish("results", {"interaction_id": interaction_id})
+
+    def _bump(self, interaction_id: int):
+        self._versions[interaction_id] = self.version(interaction_id) + 1
+        self._snapshots.pop(interaction_id, None)
+        self.stats["bumps"] += 1
+
+    def invalidate(self, interaction_id: int = None):
+        if interaction_id is None:
+            self._bump_all()
+            bus.publish("results", {"interaction_id": None})
+        else:
+            self.bump(interaction_id)
+
+    def _from_bus(self, payload: dict):
+        interaction_id = payload.get("interaction_id")
+        if interaction_id is None:
+            self._bump_all()
+        else:
+            self._bump(interaction_id)
+
+    def _bump_all(self):
+        for key in list(self._versions):
+            self._bump(key)
+
+    def etag(self, interaction_id: int, version: int) -> str:
+        return f'"{self.epoch}-{interaction_id}-{version}"'
+
+    def is_fresh(self, interaction_id: Optional[int], if_none_match: Optional[str]) -> bool:
+        """True if the client's ETag still matches the current version (answer 304)"""
+        if interaction_id is None or not if_none_match:
+            return False
+        etag = self.etag(interaction_id, self.version(interaction_id))
+        return etag in [tag.strip() for tag in if_none_match.split(",")]
+
+    async def get(self, plugin, event_id: int, interaction_id: Optional[int]) -> ResultsSnapshot:
+        if interaction_id is None:
+            # Not tied to an interaction: nothing to key the cache on
+            return ResultsSnapshot(None, 0, await plugin.get_results(event_id, None), None)
+
+        version = self.version(interaction_id)
+        snapshot = self._snapshots.get(interaction_id)
+        if snapshot is not None and snapshot.version == version:
+            self.stats["hits"] += 1
+            return snapshot
+
+        pending = self._pending.get(interaction_id)
+        if pending is not None and pending[0] == version:
+            self.stats["hits"] += 1
+            try:
+                return await asyncio.shield(pending[1])
+            except asyncio.CancelledError:
+                if not pending[1].cancelled():
+                    # This request itself was cancelled
+                    raise
+                # The request computing it was cancelled: compute it here instead
+
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[interaction_id] = (version, future)
+        try:
+            results = await plugin.get_results(event_id, interaction_id)
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters receive the exception; don't warn if there were none
+            future.exception()
+            raise
+        except BaseException:
+            # Cancelled: the waiters compute it themselves instead of hanging
+            future.cancel()
+            raise
+        finally:
+            if self._pending.get(interaction_id, (None, None))[1] is future:
+                del self._pending[interaction_id]
+
+        snapshot = ResultsSnapshot(interaction_id, version, results, self.etag(interaction_id, version))
+        # A submission that arrived while computing makes this snapshot stale already
+        if self.version(interaction_id) == version:
+            self._snapshots[interaction_id] = snapshot
+        future.set_result(snapshot)
+        return snapshot
+
+results_cache = ResultsCache()
+bus.subscribe("results", results_cache._from_bus)
+# Bumps missed while cut off from the other workers: treat every snapshot as stale
+bus.on_connect(results_cache._bump_all)
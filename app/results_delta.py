@@ -0,0 +1,113 @@
+import os
+from typing import Dict, Optional
+
+# A full snapshot is sent after this many deltas even without a resync request.
+# With several workers each one numbers its own messages, so deltas are off by default
+FULL_EVERY = int(os.getenv("RESULTS_FULL_EVERY", "50" if os.getenv("WS_BROADCAST_BACKEND", "local") == "local" else "0"))
+
+_MISSING = object()
+
+class _Removed(Exception):
+    """A key disappeared; merge deltas can't express that, so a full snapshot is sent"""
+
+def diff(old: dict, new: dict) -> dict:
+    """
+    Nested dict of the values in `new` that differ from `old`.
+
+    Dicts are diffed recursively, anything else (lists, numbers, strings)
+    is replaced as a whole. Raises _Removed if a key of `old` is missing.
+    """
+    delta = {}
+    for key in old:
+        if key not in new:
+            raise _Removed(key)
+    for key, value in new.items():
+        previous = old.get(key, _MISSING)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            nested = diff(previous, value)
+            if nested:
+                delta[key] = nested
+        elif previous is _MISSING or previous != value:
+            delta[key] = value
+    return delta
+
+class ResultsStream:
+    """What the displays last received for one interaction"""
+    __slots__ = ("seq", "results", "since_full")
+
+    def __init__(self):
+        self.seq = 0
+        self.results: Optional[dict] = None
+        self.since_full = 0
+
+class ResultsDeltaEncoder:
+    """
+    Turns successive get_results() outputs into plugin_update messages.
+
+    Each message carries a per-interaction sequence number. A full message
+    has "full": true and the whole results in "data"; a delta message has
+    "base" (the seq it applies to) and "delta" with only the changed
+    fields. A client whose last seq isn't the delta's base has missed a
+    message and asks for a resync over its WebSocket.
+    """
+
+    def __init__(self, full_every: int = FULL_EVERY):
+        self.full_every = full_every
+        self._streams: Dict[int, ResultsStream] = {}
+
+    def encode(self, plugin_id: str, interaction_id: int, results: dict) -> Optional[dict]:
+        """Next plugin_update message for the displays, or None if nothing changed"""
+        stream = self._streams.get(interaction_id)
+        if stream is None:
+            stream = self._streams[interaction_id] = ResultsStream()
+
+        delta = None
+        if stream.results is not None and stream.since_full < self.full_every:
+            try:
+                delta = diff(stream.results, results)
+            except _Removed:
+                delta = None
+            else:
+                if not delta:
+                    return None
+
+        message = {"type": "plugin_update", "plugin_id": plugin_id, "interaction_id": interaction_id}
+        if delta is None:
+            stream.since_full = 0
+            message.update(seq=stream.seq + 1, full=True, data=results)
+        else:
+            stream.since_full += 1
+            message.update(seq=stream.seq + 1, base=stream.seq, delta=delta)
+        stream.seq += 1
+        stream.results = results
+        return message
+
+    def snapshot(self, plugin_id: str, interaction_id: int, results: dict = None) -> dict:
+        """
+        Full message at the current seq, for one client that asked for a resync.
+
+        The seq is not advanced, so clients that are in sync are unaffected.
+        `results` seeds an interaction nothing has been broadcast for yet.
+        """
+        stream = self._streams.get(interaction_id)
+        if stream is None or stream.results is None:
+            stream = self._streams[interaction_id] = ResultsStream()
+            stream.seq = 1
+            stream.results = results or {}
+        return {
+            "type": "plugin_update",
+            "plugin_id": plugin_id,
+            "interaction_id": interaction_id,
+            "seq": stream.seq,
+            "full": True,
+            "data": stream.results
+        }
+
+    def has_stream(self, interaction_id: int) -> bool:
+        stream = self._streams.get(interaction_id)
+        return stream is not None and stream.results is not None
+
+    def reset(self, interaction_id: int):
+        self._streams.pop(interaction_id, None)
+
+results_stream = ResultsDeltaEncoder()
@@ -1,28 +1,108 @@
-from fastapi import APIRouter, Request, Depends, Form, HTTPException, Cookie
+from fastapi import APIRouter, Request, Form, HTTPException, Cookie
 from fastapi.responses import RedirectResponse, Response
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app.database import run_sync, run_in_session
 from app.models import Event, Participant, Plugin, Interaction
+from app.state_sync import state_channel
+from app.event_cache import active_event_cache, participant_counter
+from app.results_cache import results_cache
+from app.plugin_state import plugin_state
+from app.plugin_manager import plugin_manager
+from app import metrics
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
 
+# Each unit of work runs in one run_in_session() call (see app/routers/mobile.py)
+
+def _get_active_event(db: Session):
+    return db.query(Event).filter(Event.is_active == True).first()
+
+def _get_or_create_event(db: Session):
+    """Returns (event, created)"""
+    event = _get_active_event(db)
+    if event:
+        return event, False
+    event = Event(title="默认培训活动", host_password_hash="admin123", admin_password_hash="admin123")
+    db.add(event)
+    db.commit()
+    return event, True
+
+def _update_event(db: Session, **fields):
+    event = _get_active_event(db)
+    if event:
+        for field, value in fields.items():
+            setattr(event, field, value)
+        db.commit()
+    return event
+
+def _list_interactions(db: Session, event_id: int):
+    return db.query(Interaction).filter(Interaction.event_id == event_id).all()
+
+def _add_interaction(db: Session, **fields) -> Interaction:
+    interaction = Interaction(**fields)
+    db.add(interaction)
+    db.commit()
+    return interaction
+
+def _delete_interaction(db: Session, interaction_id: int) -> bool:
+    interaction = db.query(Interaction).filter(Interaction.id == interaction_id).first()
+    if not interaction:
+        return False
+    db.delete(interaction)
+    db.commit()
+    return True
+
+def _toggle_interaction(db: Session, interaction_id: int, enable: bool) -> bool:
+    interaction = db.query(Interaction).filter(Interaction.id == interaction_id).first()
+    if not interaction:
+        return False
+    interaction.is_enabled = enable
+    db.commit()
+    return True
+
+def _set_plugin_config(db: Session, plugin_id: str, new_config: dict):
+    event = _get_active_event(db)
+    if event:
+        # Update event-specific config
+        current_config = dict(event.plugins_config or {})
+        current_config[plugin_id] = new_config
+        event.plugins_config = current_config
+        
+        # Also update global plugin config if needed (optional)
+        # plugin = db.query(Plugin).filter(Plugin.id == plugin_id).first()
+        # if plugin:
+        #    plugin.config = new_config
+        
+        db.commit()
+
+def _start_new_event(db: Session) -> Event:
+    # Deactivate old event
+    event = _get_active_event(db)
+    if event:
+        event.is_active = False
+        
+    # Create new event
+    new_event = Event(title="新培训活动", host_password_hash="admin123")
+    db.add(new_event)
+    db.commit()
+    return new_event
+
 @router.get("/admin/login")
 async def admin_login_page(request: Request):
     return templates.TemplateResponse("admin_login.html", {"request": request})
 
 @router.post("/admin/login")
-async def admin_login(response: Response, password: str = Form(...), db: Session = Depends(get_db)):
+async def admin_login(response: Response, password: str = Form(...)):
     # Simple check for MVP
     # In reality, verify against DB or env
     # Default is "admin123"
-    event = db.query(Event).filter(Event.is_active == True).first()
     # Ensure event exists to check password
-    if not event:
-        event = Event(title="默认培训活动", host_password_hash="admin123", admin_password_hash="admin123")
-        db.add(event)
-        db.commit()
+    event, created = await run_in_session(_get_or_create_event)
+    if created:
+        active_event_cache.store(event)
+        await state_channel.refresh()
         
     if password == event.admin_password_hash or password == "admin123":
         response = RedirectResponse(url="/admin", status_code=302)
@@ -32,24 +112,23 @@ async def admin_login(response: Response, password: str = Form(...), db: Session
         return RedirectResponse(url="/admin/login?error=1", status_code=302)
 
 @router.get("/admin")
-async def admin_page(request: Request, db: Session = Depends(get_db)):
+async def admin_page(request: Request):
     if request.cookies.get("admin_session") != "authenticated":
         return RedirectResponse(url="/admin/login")
 
-    event = db.query(Event).filter(Event.is_active == True).first()
-    if not event:
-        event = Event(title="默认培训活动", host_password_hash="admin123", admin_password_hash="admin123")
-        db.add(event)
-        db.commit()
+    event, created = await run_in_session(_get_or_create_event)
+    if created:
+        active_event_cache.store(event)
+        await state_channel.refresh()
     
-    count = db.query(Participant).filter(Participant.event_id == event.id).count()
+    count = await run_sync(participant_counter.total, event.id)
     
     from app.plugin_manager import plugin_manager
     # get_all_plugins now returns dict of static plugins
     all_plugins = plugin_manager.get_all_plugins()
     
     # Fetch configured interactions
-    interactions = db.query(Interaction).filter(Interaction.event_id == event.id).all()
+    interactions = await run_in_session(_list_interactions, event.id)
     
     return templates.TemplateResponse("admin.html", {
         "request": request, 
@@ -66,29 +145,25 @@ async def admin_update(
     logo_url: str = Form(None),
     host_password: str = Form(...),
     admin_password: str = Form(...),
-    status: str = Form(...), # pending, running, ended
-    db: Session = Depends(get_db)
+    status: str = Form(...) # pending, running, ended
 ):
     if request.cookies.get("admin_session") != "authenticated":
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    event = db.query(Event).filter(Event.is_active == True).first()
+    event = await run_in_session(_update_event, title=title, logo_url=logo_url, host_password_hash=host_password,
+                                 admin_password_hash=admin_password, status=status)
     if event:
-        event.title = title
-        event.logo_url = logo_url
-        event.host_password_hash = host_password 
-        event.admin_password_hash = admin_password
-        event.status = status
-        db.commit()
+        active_event_cache.store(event)
+        await state_channel.refresh()
     return {"status": "ok"}
 
 @router.get("/api/admin/interactions")
-async def list_interactions(db: Session = Depends(get_db)):
-    event = db.query(Event).filter(Event.is_active == True).first()
+async def list_interactions():
+    event = active_event_cache.get()
     if not event:
         return []
     
-    interactions = db.query(Interaction).filter(Interaction.event_id == event.id).all()
+    interactions = await run_in_session(_list_interactions, event.id)
     return [{
         "id": i.id,
         "plugin_id": i.plugin_id,
@@ -98,8 +173,8 @@ async def list_interactions(db: Session = Depends(get_db)):
     } for i in interactions]
 
 @router.post("/api/admin/interactions")
-async def create_interaction(data: dict, db: Session = Depends(get_db)):
-    event = db.query(Event).filter(Event.is_active == True).first()
+async def create_interaction(data: dict):
+    event = active_event_cache.get()
     if not event:
         raise HTTPException(status_code=404, detail="No active event")
         
@@ -111,38 +186,37 @@ async def create_interaction(data: dict, db: Session = Depends(get_db)):
     config = data.get("config", {})
     name = data.get("name", "New Interaction")
 
-    new_interaction = Interaction(
+    new_interaction = await run_in_session(
+        _add_interaction,
         event_id=event.id,
         plugin_id=plugin_id,
         name=name,
         config=config,
         is_enabled=False
     )
-    
-    db.add(new_interaction)
-    db.commit()
-    db.refresh(new_interaction)
+    await active_event_cache.reload_interactions()
     
     return {"status": "ok", "id": new_interaction.id}
 
 @router.delete("/api/admin/interactions/{interaction_id}")
-async def delete_interaction(interaction_id: int, db: Session = Depends(get_db)):
-    interaction = db.query(Interaction).filter(Interaction.id == interaction_id).first()
-    if not interaction:
+async def delete_interaction(interaction_id: int):
+    if not await run_in_session(_delete_interaction, interaction_id):
          raise HTTPException(status_code=404, detail="Interaction not found")
          
-    db.delete(interaction)
-    db.commit()
+    await active_event_cache.reload_interactions()
+    results_cache.invalidate(interaction_id)
+    plugin_manager.invalidate_fragments(interaction_id=interaction_id)
+    await plugin_state.clear(interaction_id)
     return {"status": "ok"}
     
 @router.post("/api/admin/interactions/{interaction_id}/toggle")
-async def toggle_interaction(interaction_id: int, enable: bool, db: Session = Depends(get_db)):
-    interaction = db.query(Interaction).filter(Interaction.id == interaction_id).first()
-    if not interaction:
+async def toggle_interaction(interaction_id: int, enable: bool):
+    if not await run_in_session(_toggle_interaction, interaction_id, enable):
          raise HTTPException(status_code=404, detail="Interaction not found")
     
-    interaction.is_enabled = enable
-    db.commit()
+    await active_event_cache.reload_interactions()
+    results_cache.invalidate(interaction_id)
+    plugin_manager.invalidate_fragments(interaction_id=interaction_id)
     return {"status": "ok"}
 
 # New Endpoint for Config
@@ -150,8 +224,7 @@ async def toggle_interaction(interaction_id: int, enable: bool, db: Session = De
 async def update_plugin_config(
     request: Request,
     plugin_id: str = Form(...),
-    config_json: str = Form(...),
-    db: Session = Depends(get_db)
+    config_json: str = Form(...)
 ):
     if request.cookies.get("admin_session") != "authenticated":
          raise HTTPException(status_code=401, detail="Unauthorized")
@@ -163,32 +236,29 @@ async def update_plugin_config(
          # TODO: flash error
          return RedirectResponse(url="/admin?error=invalid_json", status_code=302)
 
-    event = db.query(Event).filter(Event.is_active == True).first()
-    if event:
-        # Update event-specific config
-        current_config = dict(event.plugins_config or {})
-        current_config[plugin_id] = new_config
-        event.plugins_config = current_config
-        
-        # Also update global plugin config if needed (optional)
-        # plugin = db.query(Plugin).filter(Plugin.id == plugin_id).first()
-        # if plugin:
-        #    plugin.config = new_config
-        
-        db.commit()
+    await run_in_session(_set_plugin_config, plugin_id, new_config)
         
     return RedirectResponse(url="/admin", status_code=302)
 
 @router.post("/api/admin/reset")
-async def admin_reset(db: Session = Depends(get_db)):
-    # Deactivate old event
-    event = db.query(Event).filter(Event.is_active == True).first()
-    if event:
-        event.is_active = False
-        
-    # Create new event
-    new_event = Event(title="新培训活动", host_password_hash="admin123")
-    db.add(new_event)
-    db.commit()
+async def admin_reset():
+    new_event = await run_in_session(_start_new_event)
+    active_event_cache.store(new_event)
+    await state_channel.refresh()
     
     return RedirectResponse(url="/admin", status_code=302)
+
+@router.get("/api/admin/queries")
+async def query_profiles(request: Request, route: str = None, min_queries: int = 0):
+    """DB query breakdown of this worker's latest requests, newest first"""
+    if request.cookies.get("admin_session") != "authenticated":
+        raise HTTPException(status_code=403, detail="Admin login required")
+    profiles = [
+        p for p in reversed(metrics.recent_requests)
+        if (route is None or p["route"] == route) and p["queries"] >= min_queries
+    ]
+    return {
+        "slow_query_ms": metrics.SLOW_QUERY_MS,
+        "repeat_threshold": metrics.REPEAT_THRESHOLD,
+        "requests": profiles
+    }
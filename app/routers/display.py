@@ -1,32 +1,49 @@
-from fastapi import APIRouter, Request, Depends, HTTPException
+from fastapi import APIRouter, Request, Response, HTTPException
+from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app.database import run_sync, run_in_session
 from app.models import Event, Participant, Interaction
-from app.utils import generate_qr_base64, get_server_url
+from app.utils import get_server_url, render_qr
 from app.plugin_manager import plugin_manager
+from app.state_sync import state_channel
+from app.event_cache import active_event_cache, participant_counter
+from app.results_cache import results_cache
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
 
+def _create_event(db: Session, title: str) -> Event:
+    event = Event(title=title, host_password_hash="admin123") # TODO: Hash password
+    db.add(event)
+    db.commit()
+    return event
+
+def _top_participants(db: Session, event_id: int, limit: int = 3):
+    return db.query(Participant)\
+        .filter(Participant.event_id == event_id)\
+        .order_by(Participant.interaction_count.desc())\
+        .limit(limit)\
+        .all()
+
 @router.get("/")
-async def display_index(request: Request, db: Session = Depends(get_db)):
+async def display_index(request: Request):
     # Get current active event or create one if none exists (MVP simplified)
-    event = db.query(Event).filter(Event.is_active == True).first()
+    event = active_event_cache.get()
     if not event:
         # Auto-create default event for MVP convenience
-        event = Event(title="新培训活动", host_password_hash="admin123") # TODO: Hash password
-        db.add(event)
-        db.commit()
-        db.refresh(event)
+        event = active_event_cache.store(await run_in_session(_create_event, "新培训活动"))
+        await state_channel.refresh()
     
     # Count participants
-    count = db.query(Participant).filter(Participant.event_id == event.id).count()
+    count = await run_sync(participant_counter.total, event.id)
     
-    # Generate QR code for signin page
-    base_url = get_server_url()
-    signin_url = f"{base_url}/signin"
-    qr_code = generate_qr_base64(signin_url)
+    # QR code for signin page: an image URL versioned by the rendered code, so the
+    # browser caches it and only refetches when the server address changes
+    signin_url = f"{get_server_url()}/signin"
+    qr = await run_sync(render_qr, signin_url)
+    qr_version = qr.etag.strip('"')
+    qr_code = f"/qr/signin.png?v={qr_version}"
     
     # Check current interaction state
     current_interaction_id = None
@@ -43,8 +60,25 @@ async def display_index(request: Request, db: Session = Depends(get_db)):
         "current_plugin_state": event.current_plugin_state
     })
 
+@router.get("/qr/signin.{fmt}")
+async def signin_qr(fmt: str, request: Request, size: int = 10, v: str = None):
+    """Sign-in QR code as PNG or SVG; rendered once per URL and size, 304 on a matching ETag"""
+    if fmt not in ("png", "svg"):
+        raise HTTPException(status_code=404, detail="Unsupported format")
+    size = min(max(size, 2), 20)
+    signin_url = f"{get_server_url()}/signin"
+    # Rendering is CPU work; only the first request per URL/size/format pays for it
+    qr = await run_sync(render_qr, signin_url, size, fmt)
+
+    # A versioned URL (?v=) never changes content; the bare URL must be revalidated
+    cache_control = "public, max-age=86400, immutable" if v and f'"{v}"' == qr.etag else "no-cache"
+    headers = {"ETag": qr.etag, "Cache-Control": cache_control}
+    if qr.etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=qr.content, media_type=qr.media_type, headers=headers)
+
 @router.get("/display/{interaction_id_or_plugin_id}")
-async def display_plugin(interaction_id_or_plugin_id: str, request: Request, db: Session = Depends(get_db)):
+async def display_plugin(interaction_id_or_plugin_id: str, request: Request):
     """Load plugin display content by interaction ID or plugin name string"""
     interaction = None
     plugin_id = interaction_id_or_plugin_id
@@ -53,11 +87,11 @@ async def display_plugin(interaction_id_or_plugin_id: str, request: Request, db:
     # Try to parse as interaction ID
     if interaction_id_or_plugin_id.isdigit():
         interaction_id = int(interaction_id_or_plugin_id)
-        interaction = db.query(Interaction).filter(Interaction.id == interaction_id).first()
+        interaction = await active_event_cache.find_interaction(interaction_id)
         if interaction:
             plugin_id = interaction.plugin_id
     
-    plugin = plugin_manager.get_plugin(plugin_id)
+    plugin = await plugin_manager.load_plugin(plugin_id)
     if not plugin:
         raise HTTPException(status_code=404, detail=f"Plugin {plugin_id} not found")
         
@@ -66,7 +100,7 @@ async def display_plugin(interaction_id_or_plugin_id: str, request: Request, db:
         raise HTTPException(status_code=404, detail="Plugin templates not found")
         
     # Config comes from Interaction if available, otherwise from plugin meta
-    config = interaction.config.copy() if interaction else plugin.meta.get("config", {})
+    config = interaction.config if interaction else plugin.meta.get("config", {})
     
     context = {
         "request": request,
@@ -76,33 +110,60 @@ async def display_plugin(interaction_id_or_plugin_id: str, request: Request, db:
         "interaction_id": interaction_id or 0,
         "plugin_id": plugin_id
     }
-    return plugin_templates.TemplateResponse("display.html", context)
+    # Identical for every display showing this interaction: rendered once
+    html = plugin_manager.render_fragment(plugin_id, "display.html", context, interaction_id=interaction_id or 0, role="display")
+    return HTMLResponse(html)
 
-@router.get("/display/results/{interaction_id_or_plugin_id}")
-async def display_results(interaction_id_or_plugin_id: str, request: Request, db: Session = Depends(get_db)):
-    """Load plugin results page by interaction ID or plugin name"""
+async def _resolve_results_target(interaction_id_or_plugin_id: str):
+    """Find (plugin, event_id, interaction) for an interaction ID or a plugin name"""
     interaction = None
     plugin_id = interaction_id_or_plugin_id
     event_id = None
     
     if interaction_id_or_plugin_id.isdigit():
         iid = int(interaction_id_or_plugin_id)
-        interaction = db.query(Interaction).filter(Interaction.id == iid).first()
+        interaction = await active_event_cache.find_interaction(iid)
         if interaction:
             plugin_id = interaction.plugin_id
             event_id = interaction.event_id
 
     if not event_id:
-        # Fallback to active event
-        event = db.query(Event).filter(Event.is_active == True).first()
+        # Fallback to active event and, if it runs this plugin, its current interaction
+        event = active_event_cache.get()
         if event:
             event_id = event.id
+            current = event.get_interaction(event.current_interaction_id) if event.current_interaction_id else None
+            if current and current.plugin_id == plugin_id:
+                interaction = current
 
-    plugin = plugin_manager.get_plugin(plugin_id)
+    plugin = await plugin_manager.load_plugin(plugin_id)
     if not plugin:
         raise HTTPException(status_code=404, detail=f"Plugin {plugin_id} not found")
+    return plugin, event_id, interaction
+
+@router.get("/api/plugin/{interaction_id_or_plugin_id}/results")
+async def plugin_results(interaction_id_or_plugin_id: str, request: Request):
+    """Results as JSON; a matching If-None-Match is answered with 304"""
+    plugin, event_id, interaction = await _resolve_results_target(interaction_id_or_plugin_id)
+    interaction_id = interaction.id if interaction else None
+
+    if results_cache.is_fresh(interaction_id, request.headers.get("if-none-match")):
+        return Response(status_code=304, headers={"ETag": results_cache.etag(interaction_id, results_cache.version(interaction_id))})
+
+    snapshot = await results_cache.get(plugin, event_id, interaction_id)
+    headers = {"Cache-Control": "no-cache"}
+    if snapshot.etag:
+        headers["ETag"] = snapshot.etag
+    return Response(content=snapshot.body, media_type="application/json", headers=headers)
+
+@router.get("/display/results/{interaction_id_or_plugin_id}")
+async def display_results(interaction_id_or_plugin_id: str, request: Request):
+    """Load plugin results page by interaction ID or plugin name"""
+    plugin, event_id, interaction = await _resolve_results_target(interaction_id_or_plugin_id)
+    plugin_id = plugin.plugin_id
         
-    results = await plugin.get_results(event_id)
+    snapshot = await results_cache.get(plugin, event_id, interaction.id if interaction else None)
+    results = snapshot.results
     
     plugin_templates = plugin_manager.get_templates(plugin_id)
     if not plugin_templates:
@@ -117,19 +178,20 @@ async def display_results(interaction_id_or_plugin_id: str, request: Request, db
         "interaction_id": interaction.id if interaction else 0,
         "plugin_id": plugin_id
     }
-    return plugin_templates.TemplateResponse("results.html", context)
+    if interaction is None:
+        # Results not tied to an interaction have no version to key a cached page on
+        return plugin_templates.TemplateResponse("results.html", context)
+    html = plugin_manager.render_fragment(plugin_id, "results.html", context, interaction_id=interaction.id,
+                                          role="display", extra=("results", snapshot.version))
+    return HTMLResponse(html)
 
 @router.get("/display/stats")
-async def display_stats(request: Request, db: Session = Depends(get_db)):
+async def display_stats(request: Request):
     """Show user interaction statistics"""
-    event = db.query(Event).filter(Event.is_active == True).first()
+    event = active_event_cache.get()
     
     # Get top 3 participants by interaction count
-    top_participants = db.query(Participant)\
-        .filter(Participant.event_id == (event.id if event else None))\
-        .order_by(Participant.interaction_count.desc())\
-        .limit(3)\
-        .all()
+    top_participants = await run_in_session(_top_participants, event.id if event else None)
         
     return templates.TemplateResponse("stats.html", {
         "request": request,
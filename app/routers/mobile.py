@@ -1,11 +1,14 @@
-from fastapi import APIRouter, Request, Depends, Form, Response, HTTPException
-from fastapi.responses import RedirectResponse
+from fastapi import APIRouter, Request, Form, Response, HTTPException
+from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse, HTMLResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
-from app.database import get_db
-from app.models import Event, Participant
+from app.database import run_in_session
 from app.models import Event, Participant, Interaction
 from app.plugin_manager import plugin_manager
+from app.state_sync import state_channel
+from app.event_cache import active_event_cache, participant_counter
+from app.results_cache import results_cache
+from app.submissions import submission_writer
 import uuid
 import random
 import asyncio
@@ -13,17 +16,77 @@ import asyncio
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
 
+# Handlers never keep a session across awaits: each unit of work below runs in one
+# run_in_session() call, so a pooled connection is only held while a DB thread uses it.
+# (A session held by a request waiting for a DB thread, while the DB threads wait for
+# a connection, stalls everything until the pool timeout.)
+
+def _get_participant(db: Session, session_token: str):
+    return db.query(Participant).filter(Participant.session_token == session_token).first()
+
+def _get_host_password(db: Session, event_id: int):
+    return db.query(Event.host_password_hash).filter(Event.id == event_id).scalar()
+
+def _create_event(db: Session, title: str) -> Event:
+    event = Event(title=title, host_password_hash="admin123")
+    db.add(event)
+    db.commit()
+    return event
+
+def _sign_in(db: Session, event_id: int, name: str, department: str, role: str):
+    """Returns (participant, created): users signing in again under the same name get a new token"""
+    session_token = str(uuid.uuid4())
+    if role == "user":
+        existing_participant = db.query(Participant).filter(
+            Participant.event_id == event_id,
+            Participant.name == name,
+            Participant.role == "user"
+        ).first()
+        if existing_participant:
+            existing_participant.session_token = session_token
+            if department:
+                existing_participant.department = department
+            db.commit()
+            return existing_participant, False
+
+    participant = Participant(
+        event_id=event_id,
+        session_token=session_token,
+        name=name,
+        department=department,
+        role=role,
+        code4=f"{random.randint(1000, 9999)}"
+    )
+    db.add(participant)
+    db.commit()
+    return participant, True
+
+def _get_active_event(db: Session):
+    return db.query(Event).filter(Event.is_active == True).first()
+
+def _get_interaction(db: Session, interaction_id: int):
+    return db.query(Interaction).filter(Interaction.id == interaction_id).first()
+
+def _update_active_event(db: Session, **fields):
+    """Set fields on the active event and commit; returns the event (None if there is none)"""
+    event = _get_active_event(db)
+    if event:
+        for field, value in fields.items():
+            setattr(event, field, value)
+        db.commit()
+    return event
+
 @router.get("/signin")
-async def signin_page(request: Request, db: Session = Depends(get_db)):
+async def signin_page(request: Request):
     # Check event status
-    event = db.query(Event).filter(Event.is_active == True).first()
+    event = active_event_cache.get()
     if not event or event.status != "running":
          return templates.TemplateResponse("mobile_no_training.html", {"request": request, "event": event})
                 
     # Check if already signed in
     session_token = request.cookies.get("session_token")
     if session_token:
-        participant = db.query(Participant).filter(Participant.session_token == session_token).first()
+        participant = await run_in_session(_get_participant, session_token)
         if participant:
             if participant.role == "host":
                 return RedirectResponse(url="/mobile/host", status_code=302)
@@ -41,62 +104,37 @@ async def signin(
     name: str = Form(...), 
     department: str = Form(None),
     role: str = Form("user"), # user or host
-    host_password: str = Form(None),
-    db: Session = Depends(get_db)
+    host_password: str = Form(None)
 ):
-    event = db.query(Event).filter(Event.is_active == True).first()
+    event = active_event_cache.get()
     if not event:
         # Should not happen if display page accessed first, but handle it
-        event = Event(title="Default Event", host_password_hash="admin123")
-        db.add(event)
-        db.commit()
+        event = active_event_cache.store(await run_in_session(_create_event, "Default Event"))
     
     # Handle Host Logic
     if role == "host":
-        if host_password != "admin123" and host_password != event.host_password_hash:
+        # Passwords are not cached, only host sign-ins read them
+        host_password_hash = await run_in_session(_get_host_password, event.id)
+        if host_password != "admin123" and host_password != host_password_hash:
              return templates.TemplateResponse("mobile_signin.html", {
                  "request": request, 
                  "error": "主持人密码错误"
              })
     
-    # Check if participant already exists for this event and name (and user role)
-    if role == "user":
-        existing_participant = db.query(Participant).filter(
-            Participant.event_id == event.id,
-            Participant.name == name,
-            Participant.role == "user"
-        ).first()
+    # Reuse the participant with this name (users only) or create one
+    participant, created = await run_in_session(_sign_in, event.id, name, department, role)
+    session_token = participant.session_token
+    if not created:
+        response = RedirectResponse(url="/mobile/home", status_code=302)
+        response.set_cookie(key="session_token", value=session_token, httponly=True)
+        return response
 
-        if existing_participant:
-            session_token = str(uuid.uuid4())
-            existing_participant.session_token = session_token
-            if department:
-                existing_participant.department = department
-            db.commit()
-            
-            redirect_url = "/mobile/home"
-            response = RedirectResponse(url=redirect_url, status_code=302)
-            response.set_cookie(key="session_token", value=session_token, httponly=True)
-            return response
-    
-    # Create Participant
-    session_token = str(uuid.uuid4())
-    code4 = f"{random.randint(1000, 9999)}"
-    
-    participant = Participant(
-        event_id=event.id,
-        session_token=session_token,
-        name=name,
-        department=department,
-        role=role,
-        code4=code4
-    )
-    db.add(participant)
-    db.commit()
+    participant_counter.increment(event.id, participant.id, role)
 
     # Notify Display to update count
-    count = db.query(Participant).filter(Participant.event_id == event.id).count()
-    await manager.broadcast_to_display({"type": "stats_update", "count": count})
+    snapshot = await state_channel.refresh()
+    # Coalesced: a burst of sign-ins sends the latest count at most once per interval
+    manager.publish(f"count:{event.id}", {"type": "stats_update", "count": snapshot["participant_count"]})
     
     # Set Cookie
     redirect_url = "/mobile/host" if role == "host" else "/mobile/home"
@@ -105,16 +143,16 @@ async def signin(
     return response
 
 @router.get("/mobile/home")
-async def mobile_home(request: Request, db: Session = Depends(get_db)):
+async def mobile_home(request: Request):
     session_token = request.cookies.get("session_token")
     if not session_token:
         return RedirectResponse(url="/signin")
         
-    participant = db.query(Participant).filter(Participant.session_token == session_token).first()
+    participant = await run_in_session(_get_participant, session_token)
     if not participant:
         return RedirectResponse(url="/signin")
         
-    event = db.query(Event).filter(Event.is_active == True).first()
+    event = active_event_cache.get()
     
     current_interaction_id = None
     if event and event.current_interaction_id and event.current_plugin_state == "running":
@@ -127,21 +165,17 @@ async def mobile_home(request: Request, db: Session = Depends(get_db)):
     })
 
 @router.get("/mobile/host")
-async def mobile_host(request: Request, db: Session = Depends(get_db)):
+async def mobile_host(request: Request):
     session_token = request.cookies.get("session_token")
     if not session_token:
         return RedirectResponse(url="/signin")
         
-    participant = db.query(Participant).filter(Participant.session_token == session_token).first()
+    participant = await run_in_session(_get_participant, session_token)
     if not participant or participant.role != "host":
         return RedirectResponse(url="/signin")
         
-    event = db.query(Event).filter(Event.is_active == True).first()
-    interactions = []
-    if event:
-        interactions = db.query(Interaction)\
-            .filter(Interaction.event_id == event.id, Interaction.is_enabled == True)\
-            .all()
+    event = active_event_cache.get()
+    interactions = event.interactions if event else []
         
     return templates.TemplateResponse("mobile_host.html", {
         "request": request, 
@@ -150,12 +184,12 @@ async def mobile_host(request: Request, db: Session = Depends(get_db)):
     })
 
 @router.get("/mobile/plugin/{interaction_id_str}")
-async def mobile_plugin(interaction_id_str: str, request: Request, db: Session = Depends(get_db)):
+async def mobile_plugin(interaction_id_str: str, request: Request):
     session_token = request.cookies.get("session_token")
     if not session_token:
         return RedirectResponse(url="/signin")
     
-    participant = db.query(Participant).filter(Participant.session_token == session_token).first()
+    participant = await run_in_session(_get_participant, session_token)
     if not participant:
         return RedirectResponse(url="/signin")
     
@@ -164,11 +198,11 @@ async def mobile_plugin(interaction_id_str: str, request: Request, db: Session =
     
     if interaction_id_str.isdigit():
         iid = int(interaction_id_str)
-        interaction = db.query(Interaction).filter(Interaction.id == iid).first()
+        interaction = await active_event_cache.find_interaction(iid)
         if interaction:
              plugin_id = interaction.plugin_id
 
-    plugin = plugin_manager.get_plugin(plugin_id)
+    plugin = await plugin_manager.load_plugin(plugin_id)
     if not plugin:
          raise HTTPException(status_code=404, detail=f"Plugin {plugin_id} not found")
  
@@ -185,100 +219,129 @@ async def mobile_plugin(interaction_id_str: str, request: Request, db: Session =
         "plugin_id": plugin_id
     }
  
-    if participant.role == "host":
-        return plugin_templates.TemplateResponse("host.html", context)
-    else:
-        return plugin_templates.TemplateResponse("user.html", context)
+    # The page doesn't depend on who the participant is, only on their role
+    template = "host.html" if participant.role == "host" else "user.html"
+    html = plugin_manager.render_fragment(plugin_id, template, context,
+                                          interaction_id=interaction.id if interaction else 0, role=participant.role)
+    return HTMLResponse(html)
 
 @router.post("/api/host/show_stats")
-async def host_show_stats(request: Request, db: Session = Depends(get_db)):
+async def host_show_stats(request: Request):
     session_token = request.cookies.get("session_token")
-    participant = db.query(Participant).filter(Participant.session_token == session_token).first()
+    participant = await run_in_session(_get_participant, session_token)
     if not participant or participant.role not in ["host", "admin"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    event = db.query(Event).filter(Event.is_active == True).first()
+    event = await run_in_session(_update_active_event, current_plugin_state="stats")
     if event:
+        active_event_cache.store(event)
         await manager.broadcast({
             "type": "show_stats"
         })
-        event.current_plugin_state = "stats"
-        db.commit()
+        await state_channel.refresh()
     
     return {"status": "ok"}
 
 @router.get("/api/training/status")
-async def get_training_status(db: Session = Depends(get_db)):
-    """获取当前培训状态 - 用于前端轮询"""
+async def get_training_status():
+    """获取当前培训状态 - 旧版轮询接口，直接读取状态快照"""
     import time
-    event = db.query(Event).filter(Event.is_active == True).first()
-    if not event:
-        return {
-            "status": "no_event",
-            "plugin_id": None,
-            "plugin_state": None,
-            "participant_count": 0,
-            "timestamp": time.time()
-        }
-    
-    participant_count = db.query(Participant).filter(Participant.event_id == event.id).count()
-    
+    snapshot = await state_channel.current()
     return {
-        "status": event.status,  # 'running' or 'idle'
-        "plugin_id": event.current_interaction_id, # Returning interaction_id as plugin_id for frontend compat
-        "plugin_state": event.current_plugin_state,  # 'running', 'results', 'idle'
-        "participant_count": participant_count,
+        "status": snapshot["status"],  # 'running' or 'idle'
+        "plugin_id": snapshot["plugin_id"], # Returning interaction_id as plugin_id for frontend compat
+        "plugin_state": snapshot["plugin_state"],  # 'running', 'results', 'idle'
+        "participant_count": snapshot["participant_count"],
         "timestamp": time.time()
     }
 
+def _client_version(request: Request, since: int) -> int:
+    """Version the client already has: ?since=, If-None-Match or Last-Event-ID"""
+    header = request.headers.get("if-none-match") or request.headers.get("last-event-id")
+    if since < 0 and header:
+        try:
+            return int(header.strip('W/"'))
+        except ValueError:
+            pass
+    return since
+
+@router.get("/api/training/state")
+async def get_training_state(request: Request, since: int = -1, timeout: float = 25):
+    """
+    长轮询培训状态: 版本号比 since 新时立即返回快照，
+    否则最多等待 timeout 秒，仍无变化则返回 304
+    """
+    await state_channel.current()
+    since = _client_version(request, since)
+    changed = await state_channel.wait_for_change(since, min(max(timeout, 0), 60))
+    etag = f'"{state_channel.version}"'
+    if not changed:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(state_channel.snapshot, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@router.get("/api/training/stream")
+async def stream_training_state(request: Request, since: int = -1):
+    """Server-Sent Events: 每次状态版本变化推送一次完整快照"""
+    await state_channel.current()
+    since = _client_version(request, since)
+    return StreamingResponse(
+        state_channel.stream(since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/api/plugin/{interaction_id_str}/missing")
-async def get_missing_numbers(interaction_id_str: str, phase: int = 1, db: Session = Depends(get_db)):
+async def get_missing_numbers(interaction_id_str: str, phase: int = 1):
     """Get missing numbers for the find numbers game - specific phase"""
-    event = db.query(Event).filter(Event.is_active == True).first()
-    if not event or not event.plugin_data:
+    interaction = None
+    if interaction_id_str.isdigit():
+        interaction = await active_event_cache.find_interaction(int(interaction_id_str))
+    else:
+        # Plugin name: the active event's current interaction if it runs this plugin
+        event = active_event_cache.get()
+        current = event.get_interaction(event.current_interaction_id) if event and event.current_interaction_id else None
+        if current and current.plugin_id == interaction_id_str:
+            interaction = current
+    plugin = await plugin_manager.load_plugin(interaction.plugin_id) if interaction else None
+    if not plugin:
         return {"missing_numbers": []}
-    
-    plugin_data = event.plugin_data or {}
+
+    # Served from the plugin state store (memory), not the database
+    state = await plugin.load_state(interaction.id)
     phase_key = f"phase{phase}_missing"
-    return {"missing_numbers": plugin_data.get(phase_key, [])}
+    return {"missing_numbers": state.get(phase_key, state.get("missing_numbers", []))}
 
 @router.post("/api/plugin/{interaction_id}/submit")
-async def submit_plugin_answer(interaction_id: int, data: dict, request: Request, db: Session = Depends(get_db)):
+async def submit_plugin_answer(interaction_id: int, data: dict, request: Request):
     """Handle user submission for plugin"""
     session_token = request.cookies.get("session_token")
     if not session_token:
         raise HTTPException(status_code=401, detail="Unauthorized")
         
-    participant = db.query(Participant).filter(Participant.session_token == session_token).first()
+    participant = await run_in_session(_get_participant, session_token)
     if not participant:
         raise HTTPException(status_code=403, detail="Forbidden")
 
-    event = db.query(Event).filter(Event.is_active == True).first()
+    event = active_event_cache.get()
     if not event:
         raise HTTPException(status_code=400, detail="No active event")
         
     if event.current_interaction_id != interaction_id or event.current_plugin_state != "running":
         raise HTTPException(status_code=400, detail="Plugin not running")
 
-    interaction = db.query(Interaction).filter(Interaction.id == interaction_id).first()
+    interaction = await active_event_cache.find_interaction(interaction_id)
     if not interaction:
         raise HTTPException(status_code=404, detail="Interaction not found")
         
-    plugin = plugin_manager.get_plugin(interaction.plugin_id)
+    plugin = await plugin_manager.load_plugin(interaction.plugin_id)
     if not plugin:
          raise HTTPException(status_code=404, detail="Plugin code not found")
 
     try:
-        # TODO: update handle_input to accept interaction_id if needed, or stick to event_id
-        # Ideally we pass interaction_id so plugin can store submissions keyed by it.
-        # But BasePlugin.handle_input signature is (event_id, user_id, data).
-        # We can pass interaction_id in 'data' or update method signature.
-        # Let's pass it in data for minimal refactor of Plugin interface.
-        data['_interaction_id'] = interaction_id
-        await plugin.handle_input(event.id, participant.id, data)
+        await plugin.handle_input(event.id, interaction_id, participant.id, data)
         
-        participant.interaction_count = (participant.interaction_count or 0) + 1
-        db.commit()
+        # Write-behind: the counter is committed with the next submission batch
+        submission_writer.increment_interaction_count(participant.id)
     except Exception as e:
         print(f"Plugin input error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -286,46 +349,40 @@ async def submit_plugin_answer(interaction_id: int, data: dict, request: Request
     return {"status": "ok"}
 
 @router.get("/api/stats/count")
-async def get_stats_count(db: Session = Depends(get_db)):
-    event = db.query(Event).filter(Event.is_active == True).first()
-    if not event:
-        return {"count": 0}
-    count = db.query(Participant).filter(Participant.event_id == event.id).count()
-    return {"count": count}
+async def get_stats_count():
+    snapshot = await state_channel.current()
+    return {"count": snapshot["participant_count"]}
 
 @router.post("/api/plugin/{interaction_id}/start")
-async def start_plugin(interaction_id: int, request: Request, db: Session = Depends(get_db)):
+async def start_plugin(interaction_id: int, request: Request):
     session_token = request.cookies.get("session_token")
     if not session_token:
         raise HTTPException(status_code=401, detail="Unauthorized")
         
-    participant = db.query(Participant).filter(Participant.session_token == session_token).first()
+    participant = await run_in_session(_get_participant, session_token)
     if not participant or participant.role != "host":
         raise HTTPException(status_code=403, detail="Forbidden")
 
-    event = db.query(Event).filter(Event.is_active == True).first()
+    event, interaction = await run_in_session(lambda db: (_get_active_event(db), _get_interaction(db, interaction_id)))
     if not event:
         raise HTTPException(status_code=400, detail="No active event")
-
-    interaction = db.query(Interaction).filter(Interaction.id == interaction_id).first()
     if not interaction:
          raise HTTPException(status_code=404, detail="Interaction not found")
          
-    plugin = plugin_manager.get_plugin(interaction.plugin_id)
+    plugin = await plugin_manager.load_plugin(interaction.plugin_id)
     if not plugin:
         raise HTTPException(status_code=404, detail="Plugin not found")
         
     # Update Event State
-    event.current_interaction_id = interaction_id
-    event.current_plugin_state = "running"
-    # Legacy field cleanup if necessary (current_plugin_id)
-    db.commit()
+    event = await run_in_session(_update_active_event, current_interaction_id=interaction_id, current_plugin_state="running")
+    if not event:
+        raise HTTPException(status_code=400, detail="No active event")
+    active_event_cache.store(event)
+    await state_channel.refresh()
     
-    # Pass interaction config if needed? 
-    # 'start' method might need to know which interaction it is.
-    # We can overload 'start' to take interaction_id or just event_id.
-    # Currently it takes event_id.
-    await plugin.start(event.id)
+    await plugin.start(event.id, interaction_id)
+    # Plugins may reset their state on start; cached results are stale
+    results_cache.bump(interaction_id)
     
     await manager.broadcast_to_display({
         "type": "plugin_start",
@@ -335,12 +392,12 @@ async def start_plugin(interaction_id: int, request: Request, db: Session = Depe
     return {"status": "ok"}
 
 @router.post("/api/plugin/countdown")
-async def plugin_countdown(request: Request, data: dict, db: Session = Depends(get_db)):
+async def plugin_countdown(request: Request, data: dict):
     session_token = request.cookies.get("session_token")
     if not session_token:
         raise HTTPException(status_code=401, detail="Unauthorized")
         
-    participant = db.query(Participant).filter(Participant.session_token == session_token).first()
+    participant = await run_in_session(_get_participant, session_token)
     if not participant or participant.role != "host":
         raise HTTPException(status_code=403, detail="Forbidden")
 
@@ -348,23 +405,23 @@ async def plugin_countdown(request: Request, data: dict, db: Session = Depends(g
     
     await manager.broadcast_to_display({"type": "countdown_start", "seconds": seconds})
     
-    asyncio.create_task(run_countdown_and_stop(seconds, request, db))
+    asyncio.create_task(run_countdown_and_stop(seconds))
     
     return {"status": "ok"}
 
 @router.post("/api/plugin/set_phase")
-async def set_plugin_phase(request: Request, data: dict, db: Session = Depends(get_db)):
+async def set_plugin_phase(request: Request, data: dict):
     session_token = request.cookies.get("session_token")
     if not session_token:
          raise HTTPException(status_code=401, detail="Unauthorized")
          
-    participant = db.query(Participant).filter(Participant.session_token == session_token).first()
+    participant = await run_in_session(_get_participant, session_token)
     if not participant or participant.role != "host":
         raise HTTPException(status_code=403, detail="Forbidden")
 
     phase = data.get("phase", 1)
     
-    event = db.query(Event).filter(Event.is_active == True).first()
+    event = active_event_cache.get()
     if not event:
         raise HTTPException(status_code=400, detail="No active event")
     
@@ -383,30 +440,33 @@ async def set_plugin_phase(request: Request, data: dict, db: Session = Depends(g
     return {"status": "ok", "phase": phase}
 
 @router.post("/api/plugin/stop")
-async def stop_plugin(request: Request, db: Session = Depends(get_db)):
+async def stop_plugin(request: Request):
     session_token = request.cookies.get("session_token")
     if not session_token:
         raise HTTPException(status_code=401, detail="Unauthorized")
         
-    participant = db.query(Participant).filter(Participant.session_token == session_token).first()
+    participant = await run_in_session(_get_participant, session_token)
     if not participant or participant.role != "host":
         raise HTTPException(status_code=403, detail="Forbidden")
 
-    event = db.query(Event).filter(Event.is_active == True).first()
+    event = await run_in_session(_get_active_event)
     if not event:
         raise HTTPException(status_code=400, detail="No active event")
 
     interaction_id = event.current_interaction_id
     if interaction_id:
         # We need plugin_id to stop it? 
-        interaction = db.query(Interaction).filter(Interaction.id == interaction_id).first()
+        interaction = await run_in_session(_get_interaction, interaction_id)
         if interaction:
-             plugin = plugin_manager.get_plugin(interaction.plugin_id)
+             plugin = await plugin_manager.load_plugin(interaction.plugin_id)
              if plugin:
-                 await plugin.stop(event.id)
+                 await plugin.stop(event.id, interaction_id)
+                 results_cache.bump(interaction_id)
             
-    event.current_plugin_state = "results"
-    db.commit()
+    event = await run_in_session(_update_active_event, current_plugin_state="results")
+    if event:
+        active_event_cache.store(event)
+    await state_channel.refresh()
     
     # Broadcast stop/results
     await manager.broadcast_to_display({"type": "plugin_end", "plugin_id": interaction_id})
@@ -415,48 +475,55 @@ async def stop_plugin(request: Request, db: Session = Depends(get_db)):
     
     return {"status": "ok"}
 
-async def run_countdown_and_stop(seconds: int, request: Request, db: Session):
+def _end_current_interaction(db: Session):
+    """Switch the running interaction to its results; None if nothing is running"""
+    event = _get_active_event(db)
+    if event and event.current_interaction_id:
+        event.current_plugin_state = "results"
+        db.commit()
+        return event
+    return None
+
+async def run_countdown_and_stop(seconds: int):
     await asyncio.sleep(seconds)
     
-    from app.database import SessionLocal
-    new_db = SessionLocal()
     try:
-        event = new_db.query(Event).filter(Event.is_active == True).first()
-        if event and event.current_interaction_id:
-            event.current_plugin_state = "results"
-            new_db.commit()
+        event = await run_in_session(_end_current_interaction)
+        if event:
+            active_event_cache.store(event)
+            await state_channel.refresh()
             await manager.broadcast_to_display({"type": "plugin_end", "plugin_id": event.current_interaction_id})
             await manager.broadcast_to_users({"type": "plugin_end", "plugin_id": event.current_interaction_id})
             await manager.broadcast_to_host({"type": "plugin_end", "plugin_id": event.current_interaction_id})
     except Exception as e:
         print(f"Error in countdown task: {e}")
-    finally:
-        new_db.close()
 
 @router.post("/api/plugin/reset")
-async def reset_plugin(request: Request, db: Session = Depends(get_db)):
+async def reset_plugin(request: Request):
     session_token = request.cookies.get("session_token")
     if not session_token:
         raise HTTPException(status_code=401, detail="Unauthorized")
         
-    participant = db.query(Participant).filter(Participant.session_token == session_token).first()
+    participant = await run_in_session(_get_participant, session_token)
     if not participant or participant.role != "host":
         raise HTTPException(status_code=403, detail="Forbidden")
 
-    event = db.query(Event).filter(Event.is_active == True).first()
+    event = await run_in_session(_get_active_event)
     if not event:
         raise HTTPException(status_code=400, detail="No active event")
 
     if event.current_interaction_id:
-        interaction = db.query(Interaction).filter(Interaction.id == event.current_interaction_id).first()
+        interaction = await run_in_session(_get_interaction, event.current_interaction_id)
         if interaction:
-            plugin = plugin_manager.get_plugin(interaction.plugin_id)
+            plugin = await plugin_manager.load_plugin(interaction.plugin_id)
             if plugin:
-                await plugin.stop(event.id)
+                await plugin.stop(event.id, interaction.id)
+                results_cache.bump(interaction.id)
 
-    event.current_interaction_id = None
-    event.current_plugin_state = "idle"
-    db.commit()
+    event = await run_in_session(_update_active_event, current_interaction_id=None, current_plugin_state="idle")
+    if event:
+        active_event_cache.store(event)
+    await state_channel.refresh()
     
     await manager.broadcast_to_display({"type": "plugin_reset"})
     await manager.broadcast_to_users({"type": "plugin_reset"})
@@ -465,8 +532,8 @@ async def reset_plugin(request: Request, db: Session = Depends(get_db)):
     return {"status": "ok"}
 
 @router.get("/api/plugin/{interaction_id}/config")
-async def get_plugin_config(interaction_id: int, db: Session = Depends(get_db)):
-    interaction = db.query(Interaction).filter(Interaction.id == interaction_id).first()
+async def get_plugin_config(interaction_id: int):
+    interaction = await active_event_cache.find_interaction(interaction_id)
     if not interaction:
          raise HTTPException(status_code=404, detail="Interaction not found")
     
@@ -474,7 +541,7 @@ async def get_plugin_config(interaction_id: int, db: Session = Depends(get_db)):
     # Merge with default if needed, or just return interaction config
     # Previously we merged with plugin.meta.config
     
-    plugin = plugin_manager.get_plugin(interaction.plugin_id)
+    plugin = await plugin_manager.load_plugin(interaction.plugin_id)
     if plugin:
         default_config = plugin.meta.get("config", {})
         # Merge: default updated by interaction config
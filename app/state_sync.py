@@ -0,0 +1,116 @@
+import asyncio
+import json
+import time
+from typing import Optional
+from app.broadcast import bus
+from app.database import run_sync
+from app.event_cache import active_event_cache, participant_counter
+
+class StateChannel:
+    """
+    Versioned snapshot of the active event's state.
+
+    Handlers that change the event call refresh() after committing. The
+    snapshot is rebuilt once, and only if its content changed is the
+    version bumped and the waiting long-poll / SSE clients woken up, so
+    idle clients cost nothing between changes.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.snapshot: Optional[dict] = None
+        self._changed = asyncio.Event()
+
+    def build_snapshot(self) -> dict:
+        event = active_event_cache.get()
+        if not event:
+            return {
+                "status": "no_event",
+                "title": None,
+                "plugin_id": None,
+                "interaction_id": None,
+                "plugin_state": None,
+                "participant_count": 0,
+                "participants_by_role": {}
+            }
+
+        return {
+            "status": event.status,
+            "title": event.title,
+            "plugin_id": event.current_interaction_id,  # interaction id, named plugin_id for frontend compat
+            "interaction_id": event.current_interaction_id,
+            "plugin_state": event.current_plugin_state,
+            "participant_count": participant_counter.total(event.id),
+            "participants_by_role": participant_counter.by_role(event.id)
+        }
+
+    async def refresh(self) -> dict:
+        """Rebuild the snapshot and publish a new version if anything changed"""
+        previous = self.snapshot
+        if self._update(await self._build()):
+            # Other workers reload the event only if more than the counts changed
+            event_changed = previous is None or any(
+                previous.get(key) != self.snapshot.get(key) for key in ("status", "title", "interaction_id", "plugin_state")
+            )
+            bus.publish("state", {"version": self.version, "event": event_changed})
+        return self.snapshot
+
+    async def _build(self) -> dict:
+        # Served from the caches; only a cold cache reads the database, off the event loop
+        return await run_sync(self.build_snapshot)
+
+    def _update(self, snapshot: dict, min_version: int = 0) -> bool:
+        changed = self.snapshot is None or any(self.snapshot.get(key) != value for key, value in snapshot.items())
+        if changed:
+            snapshot["version"] = self.version + 1
+            snapshot["timestamp"] = time.time()
+            self.snapshot = snapshot
+        # Workers adopt the highest version so a long-poll client may switch between them
+        version = max(self.snapshot["version"], min_version)
+        if version == self.version:
+            return False
+        self.version = self.snapshot["version"] = version
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+        return True
+
+    async def _from_bus(self, payload: dict):
+        """Another worker published a new state version"""
+        if payload.get("event"):
+            await run_sync(active_event_cache.load)
+        self._update(await self._build(), payload.get("version", 0))
+
+    async def current(self) -> dict:
+        # Only the very first request after startup touches the database
+        if self.snapshot is None:
+            await self.refresh()
+        return self.snapshot
+
+    async def wait_for_change(self, since: int, timeout: float) -> bool:
+        """
+        Block until the version differs from `since`; False on timeout.
+
+        A `since` ahead of the current version comes from a client that saw a
+        previous server process, so it is answered immediately as well.
+        """
+        if self.version != since:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.version != since
+
+    async def stream(self, since: int = 0, keepalive: float = 15):
+        """Server-Sent Events: one `data:` frame per new version, comments as keep-alive"""
+        while True:
+            if self.version != since and self.snapshot is not None:
+                since = self.version
+                yield f"id: {since}\ndata: {json.dumps(self.snapshot, ensure_ascii=False)}\n\n"
+            elif not await self.wait_for_change(since, keepalive):
+                yield ": keep-alive\n\n"
+
+state_channel = StateChannel()
+bus.subscribe("state", state_channel._from_bus)
+# Registered after the caches it is built from, so it sees their reloaded contents
+bus.on_connect(state_channel.refresh)
@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import func, literal_column
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from app.database import run_in_session
+from app.models import PluginSubmission, Participant
+from app.results_cache import results_cache
+
+logger = logging.getLogger(__name__)
+
+# Group commit settings: a batch is flushed after this many milliseconds or items, whichever comes first
+FLUSH_INTERVAL_MS = int(os.getenv("SUBMIT_FLUSH_INTERVAL_MS", "50"))
+FLUSH_MAX_ITEMS = int(os.getenv("SUBMIT_FLUSH_MAX_ITEMS", "200"))
+
+class SubmissionWriter:
+    """
+    Group-commit pipeline for plugin submissions.
+
+    upsert() queues a submission and waits until the batch containing it
+    has been committed, so the HTTP request is acknowledged only once the
+    row is durable, but hundreds of concurrent submits share a single
+    transaction (and fsync) instead of one each. Counter increments are
+    write-behind: they ride along with the next batch.
+
+    If a batch fails because of its data (a constraint, a value that can't
+    be stored), it is split in halves that are retried separately, so
+    only the offending submissions fail and the rest of the batch is
+    committed. Database-level errors (locked, disk full) fail the whole
+    batch without retrying.
+    """
+
+    def __init__(self, flush_interval_ms: int = FLUSH_INTERVAL_MS, flush_max_items: int = FLUSH_MAX_ITEMS):
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_max_items = flush_max_items
+        # (op, future) pairs; every op has its own future so a failure can be reported per submission
+        self._batch: List[Tuple[tuple, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_lock = asyncio.Lock()
+        self.stats = {"batches": 0, "items": 0, "last_batch_size": 0, "last_flush_ms": 0.0, "retries": 0, "failed": 0}
+
+    async def upsert(self, event_id: int, plugin_id: str, interaction_id: int, user_id: int, data: dict, merge: bool = False):
+        """
+        Insert or replace the user's submission to an interaction; with
+        merge=True the keys of `data` are merged into the stored data
+        instead of replacing it. Returns once the submission is committed.
+        """
+        await self._enqueue(("upsert", (event_id, plugin_id, interaction_id, user_id), data, merge))
+
+    def increment_interaction_count(self, participant_id: int, amount: int = 1) -> asyncio.Future:
+        """Queue a Participant.interaction_count increment (write-behind, awaiting is optional)"""
+        return self._enqueue(("increment", participant_id, amount))
+
+    def _enqueue(self, op: tuple) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        if not self._batch:
+            self._timer = loop.call_later(self.flush_interval, self._schedule_flush)
+        future = loop.create_future()
+        self._batch.append((op, future))
+        if len(self._batch) >= self.flush_max_items:
+            self._schedule_flush()
+        return future
+
+    def _schedule_flush(self):
+        batch = self._take_batch()
+        if batch:
+            asyncio.create_task(self._flush_batch(batch))
+
+    def _take_batch(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._batch = self._batch, []
+        return batch
+
+    async def flush(self):
+        """Write everything queued so far (used at shutdown)"""
+        batch = self._take_batch()
+        if batch:
+            await self._flush_batch(batch)
+        else:
+            # Wait for a flush that may already be running
+            async with self._flush_lock:
+                pass
+
+    async def _flush_batch(self, batch: List[Tuple[tuple, asyncio.Future]]):
+        # Batches are written one at a time and in order
+        async with self._flush_lock:
+            started = time.perf_counter()
+            committed = await self._commit_isolated(batch)
+
+            flush_ms = (time.perf_counter() - started) * 1000
+            self.stats["batches"] += 1
+            self.stats["items"] += committed
+            self.stats["last_batch_size"] = len(batch)
+            self.stats["last_flush_ms"] = round(flush_ms, 3)
+
+    async def _commit_isolated(self, items: List[Tuple[tuple, asyncio.Future]]) -> int:
+        """Commit items in one transaction; on a data error retry each half on its own. Returns the number committed."""
+        try:
+            # The whole transaction runs on the DB thread pool
+            await run_in_session(self._commit_batch, [op for op, _ in items])
+        except Exception as e:
+            if len(items) > 1 and not isinstance(e, OperationalError):
+                self.stats["retries"] += 1
+                middle = len(items) // 2
+                # In order, so a later submission of the same user still wins
+                return await self._commit_isolated(items[:middle]) + await self._commit_isolated(items[middle:])
+            logger.error(f"Submission batch of {len(items)} failed: {e}")
+            self.stats["failed"] += len(items)
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+                    # The exception is delivered to the waiter; don't warn if nobody awaited it
+                    future.exception()
+            return 0
+
+        for _, future in items:
+            if not future.done():
+                future.set_result(None)
+        return len(items)
+
+    def _commit_batch(self, db: Session, batch: List[tuple]):
+        try:
+            self._apply(db, batch)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+    def _apply(self, db: Session, batch: List[tuple]):
+        upserts = [op for op in batch if op[0] == "upsert"]
+        increments: Dict[int, int] = {}
+        for op in batch:
+            if op[0] == "increment":
+                increments[op[1]] = increments.get(op[1], 0) + op[2]
+
+        # Consecutive upserts of the same kind share one executemany; the order is kept
+        # so a later submission of the same user still wins
+        runs: List[Tuple[bool, List[dict]]] = []
+        for _, key, data, merge in upserts:
+            if not runs or runs[-1][0] != merge:
+                runs.append((merge, []))
+            runs[-1][1].append({
+                "event_id": key[0], "plugin_id": key[1], "interaction_id": key[2], "user_id": key[3], "data": dict(data)
+            })
+        for merge, params in runs:
+            db.execute(self._upsert_statement(merge), params)
+
+        for participant_id, amount in increments.items():
+            db.query(Participant).filter(Participant.id == participant_id).update(
+                {Participant.interaction_count: func.coalesce(Participant.interaction_count, 0) + amount},
+                synchronize_session=False
+            )
+
+    @staticmethod
+    def _upsert_statement(merge: bool):
+        """Single-statement INSERT ... ON CONFLICT DO UPDATE on the (interaction_id, user_id) unique index"""
+        stmt = sqlite_insert(PluginSubmission)
+        if merge:
+            # json_patch merges the new keys into the stored object
+            data = func.json_patch(func.coalesce(PluginSubmission.data, literal_column("'{}'")), stmt.excluded.data)
+        else:
+            data = stmt.excluded.data
+        return stmt.on_conflict_do_update(
+            index_elements=[PluginSubmission.interaction_id, PluginSubmission.user_id],
+            set_={"data": data}
+        )
+
+submission_writer = SubmissionWriter()
+
+class SubmissionStore:
+    """
+    A plugin's submissions, scoped to one interaction at a time.
+
+    Every plugin gets one as `self.submissions`. Writes go through the
+    group-commit writer; reads run on the DB thread pool and only touch the
+    rows of the requested interaction, so results stay cheap no matter how
+    many interactions of the plugin an event has run.
+    """
+
+    def __init__(self, plugin_id: str, writer: SubmissionWriter = submission_writer):
+        self.plugin_id = plugin_id
+        self.writer = writer
+
+    async def upsert(self, event_id: int, interaction_id: int, user_id: int, data: dict, merge: bool = False):
+        """Insert or replace (merge=True: merge into) the user's submission; returns once committed"""
+        await self.writer.upsert(event_id, self.plugin_id, interaction_id, user_id, data, merge=merge)
+        results_cache.bump(interaction_id)
+
+    async def get(self, interaction_id: int, user_id: int) -> Optional[dict]:
+        """The user's submission data, or None"""
+        return await run_in_session(lambda db: db.query(PluginSubmission.data).filter(
+            PluginSubmission.interaction_id == interaction_id,
+            PluginSubmission.user_id == user_id
+        ).scalar())
+
+    async def iterate(self, interaction_id: int, batch_size: int = 500):
+        """Async iterator of (user_id, data), read in pages of batch_size rows"""
+        last_id = 0
+        while True:
+            rows = await run_in_session(self._page, interaction_id, last_id, batch_size)
+            for _, user_id, data in rows:
+                yield user_id, data or {}
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    async def all(self, interaction_id: int) -> List[Tuple[int, dict]]:
+        return [item async for item in self.iterate(interaction_id)]
+
+    async def count(self, interaction_id: int) -> int:
+        return await run_in_session(lambda db: db.query(func.count(PluginSubmission.id)).filter(
+            PluginSubmission.interaction_id == interaction_id
+        ).scalar())
+
+    async def clear(self, interaction_id: int):
+        """Delete every submission of the interaction (e.g. when it is restarted)"""
+        await self.writer.flush()
+        await run_in_session(self._clear, interaction_id)
+        results_cache.bump(interaction_id)
+
+    def _page(self, db: Session, interaction_id: int, after_id: int, limit: int):
+        return db.query(PluginSubmission.id, PluginSubmission.user_id, PluginSubmission.data).filter(
+            PluginSubmission.interaction_id == interaction_id,
+            PluginSubmission.id > after_id
+        ).order_by(PluginSubmission.id).limit(limit).all()
+
+    def _clear(self, db: Session, interaction_id: int):
+        try:
+            db.query(PluginSubmission).filter(PluginSubmission.interaction_id == interaction_id).delete()
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
@@ -1,3 +1,3 @@
-from app.utils.common import generate_qr_base64, get_server_url
+from app.utils.common import generate_qr_base64, get_server_url, render_qr, server_url_cache
 
-__all__ = ['generate_qr_base64', 'get_server_url']
+__all__ = ['generate_qr_base64', 'get_server_url', 'render_qr', 'server_url_cache']
@@ -1,26 +1,122 @@
 import qrcode
+import qrcode.image.svg
 import io
 import base64
+import functools
+import hashlib
+import os
 import socket
+import threading
+import time
 
-def generate_qr_base64(data: str) -> str:
+# 网络检查间隔 (秒)：最多每隔这么久比较一次网络接口和本机地址，变化时才重新解析服务器地址
+SERVER_URL_CHECK_INTERVAL = float(os.getenv("SERVER_URL_CHECK_INTERVAL", "30"))
+
+class QRImage:
+    """A rendered QR code with its content type and ETag"""
+    __slots__ = ("content", "media_type", "etag")
+
+    def __init__(self, content: bytes, media_type: str):
+        self.content = content
+        self.media_type = media_type
+        self.etag = '"' + hashlib.sha1(content).hexdigest()[:16] + '"'
+
+@functools.lru_cache(maxsize=32)
+def render_qr(data: str, box_size: int = 10, fmt: str = "png") -> QRImage:
+    """
+    Render a QR code once per (data, size, format); later calls hit the cache.
+    fmt is "png" (needs Pillow) or "svg".
+    """
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
+        box_size=box_size,
         border=4,
     )
     qr.add_data(data)
     qr.make(fit=True)
 
-    img = qr.make_image(fill_color="black", back_color="white")
-    
     buffered = io.BytesIO()
+    if fmt == "svg":
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+        img.save(buffered)
+        return QRImage(buffered.getvalue(), "image/svg+xml")
+
+    img = qr.make_image(fill_color="black", back_color="white")
     img.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
+    return QRImage(buffered.getvalue(), "image/png")
+
+def generate_qr_base64(data: str) -> str:
+    img_str = base64.b64encode(render_qr(data).content).decode()
     return f"data:image/png;base64,{img_str}"
 
+def _local_address():
+    """本机出站地址：UDP socket 的 connect 只查路由表，不发送数据包，也不做 DNS 查询"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(("8.8.8.8", 80))
+        return s.getsockname()[0]
+    finally:
+        s.close()
+
+def _interface_fingerprint():
+    """
+    Cheap snapshot of the network setup (no DNS): the interfaces plus the
+    local address. A new DHCP lease on the same Wi-Fi interface keeps the
+    interface list but changes the address.
+    """
+    try:
+        interfaces = tuple(sorted(socket.if_nameindex()))
+    except (OSError, AttributeError):
+        # Not available on this platform: fall back to re-resolving every check interval
+        return time.monotonic()
+    try:
+        address = _local_address()
+    except OSError:
+        # No route (offline): changes again once a network comes back
+        address = None
+    return interfaces, address
+
+class ServerUrlCache:
+    """
+    get_server_url() resolved once per port and kept until the network
+    interfaces or the local address change (checked at most every
+    SERVER_URL_CHECK_INTERVAL).
+    """
+
+    def __init__(self, check_interval: float = SERVER_URL_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._urls = {}
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, port: int = 8000) -> str:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked_at >= self.check_interval:
+                self._checked_at = now
+                fingerprint = _interface_fingerprint()
+                if fingerprint != self._fingerprint:
+                    self._fingerprint = fingerprint
+                    self._urls.clear()
+            url = self._urls.get(port)
+            if url is None:
+                url = self._urls[port] = resolve_server_url(port)
+            return url
+
+    def invalidate(self):
+        with self._lock:
+            self._urls.clear()
+            self._checked_at = 0.0
+
+server_url_cache = ServerUrlCache()
+
 def get_server_url(port: int = 8000) -> str:
+    """服务器访问URL (带缓存，网络接口或本机地址变化时自动重新解析)"""
+    return server_url_cache.get(port)
+
+def resolve_server_url(port: int = 8000) -> str:
     """
     获取服务器的访问URL，优先使用局域网IP地址而不是localhost
     这样手机扫码后可以正常访问
@@ -60,13 +156,8 @@ def get_server_url(port: int = 8000) -> str:
     try:
         # 尝试获取本机局域网IP地址
         # 创建一个UDP socket连接外部地址来获取本机IP
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return f"http://{ip}:{port}"
+        return f"http://{_local_address()}:{port}"
     except Exception:
         # 如果获取失败，使用默认IP（可以通过环境变量配置）
-        import os
         default_ip = os.getenv("SERVER_IP", "localhost")
         return f"http://{default_ip}:{port}"
@@ -0,0 +1,99 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+from app.broadcast import bus
+from app.submissions import SubmissionStore
+
+class InteractionTally:
+    """Vote counts of one interaction plus each voter's current choice"""
+
+    def __init__(self):
+        self.choices: Dict[int, Optional[str]] = {}  # user_id -> choice
+        self.counts: Dict[str, int] = {}
+
+    def record(self, user_id: int, choice: Optional[str]):
+        """O(1): a re-vote moves the user's count from the old option to the new one"""
+        previous = self.choices.get(user_id)
+        if user_id in self.choices and previous == choice:
+            return
+        if previous is not None:
+            self.counts[previous] -= 1
+        self.choices[user_id] = choice
+        if choice is not None:
+            self.counts[choice] = self.counts.get(choice, 0) + 1
+
+    @property
+    def total(self) -> int:
+        return len(self.choices)
+
+    def results(self, options: List[str]) -> Tuple[int, Dict[str, int]]:
+        # Only configured options are reported, like the original full scan did
+        return self.total, {opt: self.counts.get(opt, 0) for opt in options}
+
+class VoteTally:
+    """
+    In-memory vote tallies keyed by (plugin_id, interaction_id).
+
+    A tally is seeded from plugin_submissions the first time it is needed
+    and afterwards kept current by record(), so get_results never has to
+    scan the submissions table again.
+    """
+
+    def __init__(self, choice_field: str = "value"):
+        self.choice_field = choice_field
+        self._tallies: Dict[Tuple[str, int], InteractionTally] = {}
+        self._lock = threading.Lock()
+
+    async def get(self, plugin_id: str, interaction_id: int) -> InteractionTally:
+        key = (plugin_id, interaction_id)
+        tally = self._tallies.get(key)
+        if tally is None:
+            tally = await self._seed(plugin_id, interaction_id)
+            with self._lock:
+                tally = self._tallies.setdefault(key, tally)
+        return tally
+
+    async def record(self, plugin_id: str, interaction_id: int, user_id: int, data: dict):
+        """Call after the submission has been committed"""
+        tally = await self.get(plugin_id, interaction_id)
+        choice = data.get(self.choice_field)
+        tally.record(user_id, choice)
+        bus.publish("vote_tally", {"plugin_id": plugin_id, "interaction_id": interaction_id, "user_id": user_id, "choice": choice})
+
+    def reset(self, plugin_id: str, interaction_id: int = None):
+        """Forget tallies (e.g. after the plugin cleared its submissions)"""
+        self._reset(plugin_id, interaction_id)
+        bus.publish("vote_tally", {"plugin_id": plugin_id, "interaction_id": interaction_id, "reset": True})
+
+    def _from_bus(self, payload: dict):
+        """Another worker recorded a vote or reset a tally"""
+        if payload.get("reset"):
+            self._reset(payload["plugin_id"], payload["interaction_id"])
+            return
+        # A tally this worker hasn't seeded yet will read the committed vote from the database
+        tally = self._tallies.get((payload["plugin_id"], payload["interaction_id"]))
+        if tally is not None:
+            tally.record(payload["user_id"], payload["choice"])
+
+    def _reset(self, plugin_id: str, interaction_id: int = None):
+        with self._lock:
+            for key in list(self._tallies):
+                if key[0] == plugin_id and (interaction_id is None or key[1] == interaction_id):
+                    del self._tallies[key]
+
+    def _clear(self):
+        """Forget every tally; each is reseeded from the database when next needed"""
+        with self._lock:
+            self._tallies.clear()
+
+    async def _seed(self, plugin_id: str, interaction_id: int) -> InteractionTally:
+        tally = InteractionTally()
+        if interaction_id is None:
+            return tally
+        async for user_id, data in SubmissionStore(plugin_id).iterate(interaction_id):
+            tally.record(user_id, data.get(self.choice_field))
+        return tally
+
+vote_tally = VoteTally()
+bus.subscribe("vote_tally", vote_tally._from_bus)
+# Votes recorded by other workers while cut off from them are only in the database
+bus.on_connect(vote_tally._clear)
@@ -1,56 +1,376 @@
 from fastapi import WebSocket
-from typing import List, Dict
+from typing import Dict, Iterable, Optional
+from collections import deque
+import asyncio
+import json
+import logging
+import os
+import time
+from app.broadcast import bus
+from app.metrics import registry, ws_fanout_duration
+
+logger = logging.getLogger(__name__)
+
+# Outbound queue settings for every socket (can be overridden by environment variables)
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+# What to do when a client's queue is full: drop_oldest, drop_newest or disconnect
+OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop_oldest")
+# A single send that takes longer than this marks the client as stuck (seconds)
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+# A client whose queue has been overflowing for this long without completing a send is disconnected (seconds)
+SLOW_CONSUMER_TIMEOUT = float(os.getenv("WS_SLOW_CONSUMER_TIMEOUT", "15"))
+# Server-driven heartbeat: a ping every interval, clients silent for the timeout are reaped (seconds)
+HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "15"))
+HEARTBEAT_TIMEOUT = float(os.getenv("WS_HEARTBEAT_TIMEOUT", "45"))
+# Minimum time between two sends of the same publish() topic (milliseconds)
+COALESCE_INTERVAL = float(os.getenv("WS_COALESCE_INTERVAL_MS", "250")) / 1000
+
+# State-like messages where only the newest one matters; a queued older copy is replaced.
+# plugin_update is not merged: it carries sequence numbers and deltas, and its rate
+# is already limited by publish()
+MERGEABLE_TYPES = {
+    "stats_update": (),
+}
+
+def encode_message(message: dict) -> str:
+    """Serialize a message to a text frame once (same format as WebSocket.send_json)"""
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+def merge_key(message: dict) -> Optional[str]:
+    """Return the key under which queued copies of this message may be merged, or None"""
+    msg_type = message.get("type")
+    if msg_type not in MERGEABLE_TYPES:
+        return None
+    parts = [str(msg_type)] + [str(message.get(field)) for field in MERGEABLE_TYPES[msg_type]]
+    return ":".join(parts)
+
+class ClientConnection:
+    """
+    One WebSocket with its own bounded outbound queue and writer task.
+
+    Broadcasters only enqueue frames; the writer task drains the queue, so a
+    stalled phone can neither block the caller nor grow memory without limit.
+    """
+
+    def __init__(self, websocket: WebSocket, role: str, on_evict=None):
+        self.websocket = websocket
+        self.role = role
+        self.queue = deque()  # entries are [merge_key, frame]
+        self.merge_index = {}  # merge_key -> queued entry
+        self.dropped = 0
+        self.closed = False
+        self.last_progress = time.monotonic()
+        self.overflow_since = None  # when the queue started overflowing, None while it has room
+        self.last_seen = time.monotonic()
+        self._on_evict = on_evict
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._writer())
+
+    def mark_alive(self):
+        """Record that the client sent something (pong or any other message)"""
+        self.last_seen = time.monotonic()
+
+    def enqueue(self, frame: str, key: Optional[str] = None) -> bool:
+        """Queue a frame without blocking. Returns False if it was dropped."""
+        if self.closed:
+            return False
+
+        if key is not None and key in self.merge_index:
+            # Newer state replaces the stale copy still waiting in the queue
+            self.merge_index[key][1] = frame
+            return True
+
+        if len(self.queue) >= SEND_QUEUE_SIZE:
+            self.dropped += 1
+            now = time.monotonic()
+            if self.overflow_since is None:
+                self.overflow_since = now
+            # An idle client's first overflow is not a slow consumer: its writer may
+            # simply not have run yet. Only a backlog that lasts is.
+            stalled_for = now - max(self.overflow_since, self.last_progress)
+            if OVERFLOW_POLICY == "disconnect" or stalled_for > SLOW_CONSUMER_TIMEOUT:
+                self.evict("send queue overflow")
+                return False
+            if OVERFLOW_POLICY == "drop_newest":
+                return False
+            stale = self.queue.popleft()
+            if self.merge_index.get(stale[0]) is stale:
+                del self.merge_index[stale[0]]
+
+        entry = [key, frame]
+        self.queue.append(entry)
+        if key is not None:
+            self.merge_index[key] = entry
+        self._wakeup.set()
+        return True
+
+    async def _writer(self):
+        try:
+            while True:
+                while not self.queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+
+                entry = self.queue.popleft()
+                if self.merge_index.get(entry[0]) is entry:
+                    del self.merge_index[entry[0]]
+
+                try:
+                    await asyncio.wait_for(self.websocket.send_text(entry[1]), SEND_TIMEOUT)
+                except asyncio.TimeoutError:
+                    self.evict("send timeout")
+                    return
+                except Exception:
+                    # Handle broken pipe or closed connection
+                    self.evict("send failed")
+                    return
+                self.last_progress = time.monotonic()
+                if not self.queue:
+                    self.overflow_since = None
+        except asyncio.CancelledError:
+            pass
+
+    def evict(self, reason: str):
+        """Drop the client: stop the writer, close the socket and unregister it"""
+        if self.closed:
+            return
+        logger.warning(f"Disconnecting {self.role} client ({reason}, {len(self.queue)} queued, {self.dropped} dropped)")
+        self.close()
+        asyncio.create_task(self._close_socket())
+        if self._on_evict:
+            self._on_evict(self)
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        self.merge_index.clear()
+        if self._task and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    async def _close_socket(self):
+        try:
+            # 1013: try again later
+            await asyncio.wait_for(self.websocket.close(code=1013), SEND_TIMEOUT)
+        except Exception:
+            pass
+
+class TopicState:
+    """Latest unsent value of a publish() topic and when it was last sent"""
+    __slots__ = ("message", "target", "last_sent", "timer")
+
+    def __init__(self):
+        self.message = None
+        self.target = None
+        self.last_sent = 0.0
+        self.timer = None
 
 class ConnectionManager:
     def __init__(self):
-        # active_connections: List[WebSocket] = []
-        # Store connections by role or event for better targeting later
-        self.active_connections: Dict[str, List[WebSocket]] = {
-            "display": [],
-            "host": [],
-            "user": []
+        # Store connections by role; each role maps WebSocket -> ClientConnection
+        # so registering and removing a socket is O(1)
+        self.active_connections: Dict[str, Dict[WebSocket, ClientConnection]] = {
+            "display": {},
+            "host": {},
+            "user": {}
         }
+        # Fan-out statistics: totals since startup plus the most recent fan-out
+        self.fanout_stats = {
+            "fanouts": 0,
+            "sends": 0,
+            "failures": 0,
+            "evictions": 0,
+            "last": None
+        }
+        # Topic coalescing statistics: publish() calls, messages actually sent, values replaced before sending
+        self.publish_stats = {
+            "published": 0,
+            "sent": 0,
+            "coalesced": 0
+        }
+        self._topics: Dict[str, TopicState] = {}
+        self._heartbeat_task = None
 
-    async def connect(self, websocket: WebSocket, role: str = "user"):
+    async def connect(self, websocket: WebSocket, role: str = "user") -> ClientConnection:
         await websocket.accept()
         if role not in self.active_connections:
-            self.active_connections[role] = []
-        self.active_connections[role].append(websocket)
+            self.active_connections[role] = {}
+        client = ClientConnection(websocket, role, on_evict=self._evicted)
+        client.start()
+        self.active_connections[role][websocket] = client
+        return client
 
     def disconnect(self, websocket: WebSocket, role: str = "user"):
-        if role in self.active_connections:
-            if websocket in self.active_connections[role]:
-                self.active_connections[role].remove(websocket)
+        client = self.active_connections.get(role, {}).pop(websocket, None)
+        if client:
+            client.close()
+
+    def connection_counts(self) -> Dict[str, int]:
+        """Number of live connections per role"""
+        return {role: len(clients) for role, clients in self.active_connections.items()}
 
-    async def broadcast(self, message: dict):
+    def start_heartbeat(self):
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop_heartbeat(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
+    async def _heartbeat(self):
+        """Ping every client periodically and reap the ones that stopped answering"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            now = time.monotonic()
+            for clients in list(self.active_connections.values()):
+                for client in list(clients.values()):
+                    if now - client.last_seen > HEARTBEAT_TIMEOUT:
+                        client.evict("missed heartbeats")
+            # Every worker pings its own sockets: not forwarded to the bus
+            await self.fanout(self._clients("all"), {"type": "ping", "ts": time.time()})
+
+    def _evicted(self, client: ClientConnection):
+        self.fanout_stats["evictions"] += 1
+        self.disconnect(client.websocket, client.role)
+
+    async def fanout(self, clients: Iterable[ClientConnection], message: dict) -> dict:
+        """
+        Queue one message for many sockets.
+
+        The message is encoded to a text frame once and handed to every
+        target's writer task, so a slow client only delays itself. Returns
+        the duration and failure (dropped) count of this fan-out.
+        """
+        return self._fanout_frame(clients, encode_message(message), message.get("type"), merge_key(message))
+
+    def _fanout_frame(self, clients: Iterable[ClientConnection], frame: str, msg_type: Optional[str], key: Optional[str]) -> dict:
+        targets = list(clients)
+        if not targets:
+            return {"type": msg_type, "targets": 0, "failures": 0, "duration_ms": 0.0}
+
+        started = time.perf_counter()
+        failures = 0
+        for client in targets:
+            if not client.enqueue(frame, key):
+                failures += 1
+        duration = time.perf_counter() - started
+        duration_ms = duration * 1000
+        ws_fanout_duration.observe(duration, msg_type or "unknown")
+
+        report = {
+            "type": msg_type,
+            "targets": len(targets),
+            "failures": failures,
+            "duration_ms": round(duration_ms, 3)
+        }
+        self.fanout_stats["fanouts"] += 1
+        self.fanout_stats["sends"] += len(targets)
+        self.fanout_stats["failures"] += failures
+        self.fanout_stats["last"] = report
+
+        if failures:
+            logger.warning(f"Fan-out {report['type']} to {len(targets)} sockets: {failures} dropped in {duration_ms:.1f}ms")
+        else:
+            logger.debug(f"Fan-out {report['type']} to {len(targets)} sockets in {duration_ms:.1f}ms")
+        return report
+
+    def publish(self, topic: str, message, target: str = "display", interval: float = None):
+        """
+        Coalesced broadcast for high-rate state such as results:<interaction> or count:<event>.
+
+        Only the latest message of a topic is sent, at most once per interval
+        (WS_COALESCE_INTERVAL_MS by default). The first publish after a quiet
+        period goes out on the next loop iteration; publishes during the
+        interval replace each other and are sent when it ends. `message` may
+        also be a callable (sync or async) returning the message, so costly
+        payloads are only built for the sends that actually happen. `target`
+        is a role name or "all". Does not block.
+        """
+        interval = COALESCE_INTERVAL if interval is None else interval
+        state = self._topics.get(topic)
+        if state is None:
+            state = self._topics[topic] = TopicState()
+
+        self.publish_stats["published"] += 1
+        if state.message is not None:
+            self.publish_stats["coalesced"] += 1
+        state.message = message
+        state.target = target
+        if state.timer is not None:
+            return
+
+        loop = asyncio.get_running_loop()
+        delay = state.last_sent + interval - time.monotonic()
+        if delay <= 0:
+            state.timer = loop.call_soon(self._flush_topic, topic)
+        else:
+            state.timer = loop.call_later(delay, self._flush_topic, topic)
+
+    def _flush_topic(self, topic: str):
+        state = self._topics[topic]
+        message, target = state.message, state.target
+        state.message = None
+        state.timer = None
+        state.last_sent = time.monotonic()
+        if message is not None:
+            asyncio.create_task(self._send_topic(topic, message, target))
+
+    async def _send_topic(self, topic: str, message, target: str):
+        try:
+            if callable(message):
+                message = message()
+                if asyncio.iscoroutine(message):
+                    message = await message
+            if message is None:
+                return
+            self.publish_stats["sent"] += 1
+            await self._broadcast(target, message)
+        except Exception as e:
+            logger.error(f"Publishing topic {topic} failed: {e}")
+
+    def _clients(self, target: str) -> Iterable[ClientConnection]:
+        if target == "all":
+            return [client for role_conns in self.active_connections.values() for client in role_conns.values()]
+        return list(self.active_connections.get(target, {}).values())
+
+    async def _broadcast(self, target: str, message: dict) -> dict:
+        """Fan out to this worker's sockets of `target` and forward the frame to the other workers"""
+        frame = encode_message(message)
+        key = merge_key(message)
+        bus.publish("ws", {"target": target, "type": message.get("type"), "key": key, "frame": frame})
+        return self._fanout_frame(self._clients(target), frame, message.get("type"), key)
+
+    def _from_bus(self, payload: dict):
+        """A broadcast made by another worker: deliver the already-encoded frame to our sockets"""
+        self._fanout_frame(self._clients(payload["target"]), payload["frame"], payload.get("type"), payload.get("key"))
+
+    async def broadcast(self, message: dict) -> dict:
         # Broadcast to all
-        for role_conns in self.active_connections.values():
-            for connection in role_conns:
-                try:
-                    await connection.send_json(message)
-                except Exception:
-                    # Handle broken pipe or closed connection
-                    pass
-    
-    async def broadcast_to_display(self, message: dict):
-        for connection in self.active_connections["display"]:
-             try:
-                await connection.send_json(message)
-             except Exception:
-                pass
-
-    async def broadcast_to_host(self, message: dict):
-        for connection in self.active_connections["host"]:
-             try:
-                await connection.send_json(message)
-             except Exception:
-                pass
-
-    async def broadcast_to_users(self, message: dict):
-        for connection in self.active_connections["user"]:
-             try:
-                await connection.send_json(message)
-             except Exception:
-                pass
+        return await self._broadcast("all", message)
+
+    async def broadcast_to_display(self, message: dict) -> dict:
+        return await self._broadcast("display", message)
+
+    async def broadcast_to_host(self, message: dict) -> dict:
+        return await self._broadcast("host", message)
+
+    async def broadcast_to_users(self, message: dict) -> dict:
+        return await self._broadcast("user", message)
 
 manager = ConnectionManager()
+bus.subscribe("ws", manager._from_bus)
+
+@registry.collected("ws_connections", "Live WebSocket connections of this worker", labels=("role",))
+def _ws_connections():
+    return [((role,), count) for role, count in manager.connection_counts().items()]
+
+@registry.collected("ws_fanout_failures_total", "Messages dropped because a socket's queue was full", kind="counter")
+def _ws_fanout_failures():
+    return [((), manager.fanout_stats["failures"])]
+
+@registry.collected("ws_evictions_total", "Sockets closed for missed heartbeats or a full queue", kind="counter")
+def _ws_evictions():
+    return [((), manager.fanout_stats["evictions"])]
@@ -0,0 +1,277 @@
+"""
+插件基准测试 (Plugin benchmarks): times each plugin's get_results and handle_input at scale.
+
+A scratch SQLite database is seeded with N synthetic PluginSubmission
+rows per plugin (1k, 10k and 100k by default) and every plugin entry
+point is timed: get_results with cold caches (first call after startup),
+get_results warm, and a burst of concurrent handle_input calls. Peak
+Python memory of each entry point is measured with tracemalloc in a
+separate pass, so it does not distort the timings.
+
+    python bench_plugins.py                                  # writes bench_results.json
+    python bench_plugins.py --sizes 1000 10000 --plugins demo_vote find_numbers
+    python bench_plugins.py --output new.json --compare bench_results.json --max-regression 0.25
+
+With --compare the medians are printed next to the earlier file's and
+the exit code is 1 if any time or memory figure grew by more than
+--max-regression.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix="bench_plugins_")
+SCRATCH_DB = os.path.join(SCRATCH_DIR, "bench.db")
+# Must be set before anything imports app.database
+os.environ["APP_DATABASE_URL"] = f"sqlite:///{SCRATCH_DB}"
+os.environ.setdefault("PLUGIN_HOT_RELOAD", "0")
+
+from sqlalchemy import insert
+from app.database import engine, Base
+import app.models
+from app.models import Event, Participant, Interaction, PluginSubmission
+from app.migrations import run_migrations
+from app.plugin_manager import plugin_manager
+from app.event_cache import active_event_cache, participant_counter
+from app.plugin_state import plugin_state
+from app.results_cache import results_cache
+from app.submissions import submission_writer
+from app.vote_tally import vote_tally
+
+DEFAULT_PLUGINS = ["ai_survey", "demo_vote", "demo_finder", "find_numbers"]
+OPTIONS = ["A", "B", "C", "D", "E"]
+
+def numbers(count: int = 10):
+    return sorted(random.sample(range(1, 101), count))
+
+def submission_data(plugin_id: str) -> dict:
+    """A stored submission shaped like the plugin's own"""
+    if plugin_id == "demo_finder":
+        data = {}
+        for phase in (1, 2, 3):
+            data[f"phase{phase}_submitted"] = numbers()
+            data[f"phase{phase}_score"] = random.randint(0, 10)
+        return data
+    if plugin_id == "find_numbers":
+        return {"answers": numbers(), "score": random.randint(0, 10)}
+    return {"value": random.choice(OPTIONS)}
+
+def input_data(plugin_id: str) -> dict:
+    """What a participant POSTs to /api/plugin/{id}/submit"""
+    if plugin_id == "demo_finder":
+        return {"phase": random.randint(1, 3), "submitted_numbers": numbers()}
+    if plugin_id == "find_numbers":
+        return {"answers": numbers()}
+    return {"value": random.choice(OPTIONS)}
+
+def reset_caches(interaction_id: int):
+    """Forget everything a fresh server process would not have in memory"""
+    active_event_cache.invalidate()
+    participant_counter.invalidate()
+    results_cache.invalidate()
+    plugin_state.evict(interaction_id)
+    for plugin_id in plugin_manager.manifests:
+        vote_tally.reset(plugin_id, interaction_id)
+
+def seed(size: int, plugins):
+    """Fresh schema with one active event, `size` participants and one interaction per plugin"""
+    # A new file for every size (events and interactions reference each other, so drop_all can't sort them)
+    engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(SCRATCH_DB + suffix):
+            os.remove(SCRATCH_DB + suffix)
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    plugin_manager.load_plugins()
+    with engine.begin() as conn:
+        event_id = conn.execute(insert(Event).values(title="Benchmark", is_active=True, status="running")).inserted_primary_key[0]
+        conn.execute(insert(Participant), [
+            {"event_id": event_id, "session_token": f"bench-{i}", "name": f"bench{i}", "role": "user", "code4": "0000"}
+            for i in range(size)
+        ])
+        user_ids = [row[0] for row in conn.exec_driver_sql("SELECT id FROM participants ORDER BY id")]
+        interactions = {}
+        for plugin_id in plugins:
+            interactions[plugin_id] = conn.execute(insert(Interaction).values(
+                event_id=event_id, plugin_id=plugin_id, name=plugin_id, is_enabled=True,
+                config={"question": "Benchmark", "options": OPTIONS}
+            )).inserted_primary_key[0]
+    return event_id, user_ids, interactions
+
+def seed_submissions(event_id: int, plugin_id: str, interaction_id: int, user_ids, batch: int = 10000):
+    with engine.begin() as conn:
+        for start in range(0, len(user_ids), batch):
+            conn.execute(insert(PluginSubmission), [
+                {"event_id": event_id, "plugin_id": plugin_id, "interaction_id": interaction_id,
+                 "user_id": user_id, "data": submission_data(plugin_id)}
+                for user_id in user_ids[start:start + batch]
+            ])
+
+async def timed(func, repeat: int, before=None) -> dict:
+    samples = []
+    for _ in range(repeat):
+        if before:
+            before()
+        started = time.perf_counter()
+        await func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"median": round(statistics.median(samples), 3), "min": round(min(samples), 3)}
+
+async def peak_kb(func, before=None) -> float:
+    if before:
+        before()
+    tracemalloc.start()
+    try:
+        await func()
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+async def bench_plugin(plugin_id: str, event_id: int, interaction_id: int, user_ids, args) -> dict:
+    plugin = plugin_manager.get_plugin(plugin_id)
+    # start() clears old submissions and creates the game state of the interaction
+    await plugin.start(event_id, interaction_id)
+    seed_submissions(event_id, plugin_id, interaction_id, user_ids)
+    await plugin_state.checkpoint()
+
+    burst = min(args.inputs, len(user_ids))
+
+    async def get_results():
+        await plugin.get_results(event_id, interaction_id)
+
+    async def handle_inputs():
+        # Concurrent re-submissions, like a room answering at once
+        await asyncio.gather(*(
+            plugin.handle_input(event_id, interaction_id, user_id, input_data(plugin_id))
+            for user_id in random.sample(user_ids, burst)
+        ))
+
+    cold = lambda: reset_caches(interaction_id)
+    result = {
+        "get_results_cold_ms": await timed(get_results, args.repeat, before=cold),
+        "get_results_warm_ms": await timed(get_results, args.repeat),
+        "handle_input_burst_ms": await timed(handle_inputs, args.repeat),
+        "get_results_cold_peak_kb": await peak_kb(get_results, before=cold),
+        "handle_input_burst_peak_kb": await peak_kb(handle_inputs),
+        "inputs_per_burst": burst,
+    }
+    result["handle_input_ms_per_input"] = round(result["handle_input_burst_ms"]["median"] / burst, 4)
+    return result
+
+async def run_size(size: int, args) -> dict:
+    random.seed(size)
+    event_id, user_ids, interactions = seed(size, args.plugins)
+    results = {}
+    for plugin_id in args.plugins:
+        if plugin_id not in plugin_manager.manifests:
+            print(f"  skipping unknown plugin {plugin_id}")
+            continue
+        started = time.perf_counter()
+        results[plugin_id] = await bench_plugin(plugin_id, event_id, interactions[plugin_id], user_ids, args)
+        r = results[plugin_id]
+        print(f"  {plugin_id:<14} cold {r['get_results_cold_ms']['median']:>10.2f} ms  "
+              f"warm {r['get_results_warm_ms']['median']:>9.3f} ms  "
+              f"input {r['handle_input_ms_per_input']:>8.4f} ms  "
+              f"peak {r['get_results_cold_peak_kb']:>9.1f} KB  ({time.perf_counter() - started:.1f}s)")
+    await submission_writer.flush()
+    await plugin_state.checkpoint()
+    plugin_state.evict()
+    return results
+
+async def run_all(args) -> dict:
+    # One event loop for every size: the app's singletons hold loop-bound locks
+    results = {}
+    for size in args.sizes:
+        print(f"== {size} submissions per plugin")
+        results[str(size)] = await run_size(size, args)
+    return results
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def flatten(report: dict) -> dict:
+    """(plugin, size, metric) -> comparable number"""
+    values = {}
+    for size, plugins in report["results"].items():
+        for plugin_id, metrics in plugins.items():
+            for metric, value in metrics.items():
+                if isinstance(value, dict):
+                    value = value["median"]
+                if metric.endswith("_ms") or metric.endswith("_kb") or metric.endswith("_per_input"):
+                    values[(plugin_id, size, metric)] = value
+    return values
+
+# Differences below these are noise, whatever their percentage
+NOISE_FLOOR = {"ms": 1.0, "kb": 64.0, "per_input": 0.01}
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list:
+    new, old = flatten(report), flatten(baseline)
+    regressions = []
+    print(f"\nCompared with {baseline.get('revision')} ({baseline.get('timestamp')}):")
+    for setting in ("inputs", "db_profile", "python"):
+        if baseline.get(setting) != report.get(setting):
+            print(f"  warning: {setting} differs ({baseline.get(setting)} -> {report.get(setting)}), figures may not be comparable")
+    print(f"{'plugin':<14}{'size':>8}  {'metric':<28}{'before':>12}{'after':>12}{'change':>9}")
+    for key in sorted(new):
+        if key not in old:
+            continue
+        before, after = old[key], new[key]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        floor = NOISE_FLOOR[key[2].rsplit("_", 1)[-1] if not key[2].endswith("_per_input") else "per_input"]
+        if change > max_regression and after - before > floor:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print(f"{key[0]:<14}{key[1]:>8}  {key[2]:<28}{before:>12}{after:>12}{change:>+9.1%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark plugin get_results / handle_input")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="submissions per plugin")
+    parser.add_argument("--plugins", nargs="+", default=DEFAULT_PLUGINS)
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per entry point (the median is reported)")
+    parser.add_argument("--inputs", type=int, default=500, help="concurrent handle_input calls per burst")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="allowed growth before --compare fails (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "db_profile": os.getenv("APP_DB_PROFILE", "default"),
+        "repeat": args.repeat,
+        "inputs": args.inputs,
+        "results": {}
+    }
+    report["results"] = asyncio.run(run_all(args))
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {args.output}")
+
+    failed = False
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            failed = bool(compare(report, json.load(f), args.max_regression))
+    engine.dispose()
+    shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+压力测试 (Load test): simulates a room full of attendees against a running server.
+
+Every attendee signs in (POST /api/signin), keeps a WebSocket open on
+/ws/user, polls /api/training/status and submits to the running
+interaction; a simulated host starts the interaction, stops it directly
+and via the countdown. Per-route p50/p95/p99 latencies, WebSocket
+delivery latency and errors are reported, and with budgets set the exit
+code is 1 when one is exceeded, so it can gate a release.
+
+Each attendee count is run in two scenarios: "ramp", where attendees
+arrive over --ramp seconds, and "burst", where all of them sign in at
+the same moment, like a room scanning the QR code together. A sign-in
+slower than --max-signin (default 5s) fails the budget, so a burst that
+stalls on the database connection pool is caught.
+
+Start the server first (python run.py), then for example:
+
+    python loadtest.py --users 200
+    python loadtest.py --users 200 1000 5000 --max-p95 300 --max-ws-p95 500 --max-error-rate 0.01
+    python loadtest.py --users 1000 --json loadtest.json
+    python loadtest.py --users 500 --scenarios burst
+
+The run creates one interaction (demo_vote by default) in the active
+event and signs in users named lt<run>-<n>; don't point it at a live event.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+try:
+    import httpx
+    import websockets
+except ImportError:
+    print("缺少依赖包 (Missing packages): pip install httpx websockets")
+    sys.exit(1)
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile; 0 for no values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+class Metrics:
+    """Latencies (ms) and error counts per route, plus WebSocket delivery latencies per message type"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.error_samples: Dict[str, str] = {}
+        self.delivery: Dict[str, List[float]] = defaultdict(list)
+        self.missed: Dict[str, int] = defaultdict(int)
+
+    def record(self, route: str, started: float, ok: bool, detail: str = None):
+        self.latencies[route].append((time.perf_counter() - started) * 1000)
+        if not ok:
+            self.errors[route] += 1
+            if detail and route not in self.error_samples:
+                self.error_samples[route] = detail[:200]
+
+    def summary(self) -> dict:
+        routes = {}
+        for route in sorted(set(self.latencies) | set(self.errors)):
+            values = self.latencies[route]
+            routes[route] = {
+                "count": len(values),
+                "errors": self.errors[route],
+                "error_rate": round(self.errors[route] / len(values), 4) if values else 0,
+                "p50": round(percentile(values, 50), 1),
+                "p95": round(percentile(values, 95), 1),
+                "p99": round(percentile(values, 99), 1),
+                "max": round(max(values), 1) if values else 0
+            }
+        ws = {}
+        for msg_type in sorted(set(self.delivery) | set(self.missed)):
+            values = self.delivery[msg_type]
+            ws[msg_type] = {
+                "delivered": len(values),
+                "missed": self.missed[msg_type],
+                "p50": round(percentile(values, 50), 1),
+                "p95": round(percentile(values, 95), 1),
+                "p99": round(percentile(values, 99), 1),
+                "max": round(max(values), 1) if values else 0
+            }
+        return {"routes": routes, "websocket": ws, "error_samples": dict(self.error_samples)}
+
+class Attendee:
+    def __init__(self, run: "LoadTest", index: int):
+        self.run = run
+        self.name = f"lt{run.run_id}-{index}"
+        self.token: Optional[str] = None
+        self.ws = None
+        # message type -> monotonic time of the first arrival since the last reset
+        self.received: Dict[str, float] = {}
+        self.arrived: Dict[str, asyncio.Event] = defaultdict(asyncio.Event)
+
+    async def sign_in(self):
+        self.token = await self.run.sign_in(self.name, "user")
+
+    async def open_socket(self):
+        started = time.perf_counter()
+        try:
+            self.ws = await websockets.connect(self.run.ws_url + "/ws/user", open_timeout=self.run.args.timeout, max_queue=None)
+        except Exception as e:
+            self.run.metrics.record("WS /ws/user connect", started, False, repr(e))
+            return
+        self.run.metrics.record("WS /ws/user connect", started, True)
+        asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        try:
+            async for frame in self.ws:
+                now = time.perf_counter()
+                try:
+                    message = json.loads(frame)
+                except ValueError:
+                    continue
+                msg_type = message.get("type")
+                if msg_type == "ping":
+                    # The server reaps clients that never answer its heartbeat
+                    await self.ws.send('{"type":"pong"}')
+                    continue
+                if msg_type not in self.received:
+                    self.received[msg_type] = now
+                    self.arrived[msg_type].set()
+        except Exception:
+            if not self.run.stopping:
+                self.run.metrics.errors["WS /ws/user disconnected"] += 1
+
+    def expect(self, msg_type: str):
+        self.received.pop(msg_type, None)
+        self.arrived[msg_type].clear()
+
+    async def poll(self):
+        interval = self.run.args.poll_interval
+        # Spread the polls of all attendees over the interval
+        await asyncio.sleep(random.uniform(0, interval))
+        while not self.run.stopping:
+            await self.run.request("GET", "/api/training/status", "GET /api/training/status")
+            await asyncio.sleep(interval)
+
+    async def submit(self, interaction_id: int, options: List[str]):
+        await asyncio.sleep(random.uniform(0, self.run.args.think_time))
+        await self.run.request(
+            "POST", f"/api/plugin/{interaction_id}/submit", "POST /api/plugin/{id}/submit",
+            token=self.token, json={"value": random.choice(options)}
+        )
+
+class LoadTest:
+    OPTIONS = ["A", "B", "C", "D"]
+
+    def __init__(self, args, users: int, run_id: str, scenario: str = "ramp"):
+        self.args = args
+        self.users = users
+        self.run_id = run_id
+        self.scenario = scenario
+        # burst: every attendee signs in at once
+        self.ramp = args.ramp if scenario == "ramp" else 0.0
+        self.base_url = args.url.rstrip("/")
+        self.ws_url = "ws" + self.base_url[4:]
+        self.metrics = Metrics()
+        self.stopping = False
+        self.client: Optional[httpx.AsyncClient] = None
+
+    async def request(self, method: str, path: str, route: str, token: str = None, **kwargs) -> Optional[httpx.Response]:
+        headers = kwargs.pop("headers", {})
+        if token:
+            # Cookies are passed per request: one shared client serves every attendee
+            headers["Cookie"] = f"session_token={token}"
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, self.base_url + path, headers=headers, **kwargs)
+        except Exception as e:
+            self.metrics.record(route, started, False, repr(e))
+            return None
+        ok = response.status_code < 400
+        self.metrics.record(route, started, ok, None if ok else f"{response.status_code} {response.text}")
+        return response
+
+    async def sign_in(self, name: str, role: str) -> Optional[str]:
+        data = {"name": name, "role": role}
+        if role == "host":
+            data["host_password"] = self.args.host_password
+        response = await self.request("POST", "/api/signin", "POST /api/signin", data=data, follow_redirects=False)
+        # Keep the shared client's cookie jar empty; tokens are sent explicitly
+        self.client.cookies.clear()
+        return response.cookies.get("session_token") if response is not None else None
+
+    async def setup(self) -> int:
+        """Log in as admin and create an enabled interaction for this run"""
+        response = await self.client.post(self.base_url + "/admin/login", data={"password": self.args.admin_password}, follow_redirects=False)
+        admin = response.cookies.get("admin_session")
+        self.client.cookies.clear()
+        if not admin:
+            raise RuntimeError(f"Admin login failed ({response.status_code})")
+        cookies = {"Cookie": f"admin_session={admin}"}
+        response = await self.client.post(self.base_url + "/api/admin/interactions", headers=cookies, json={
+            "plugin_id": self.args.plugin,
+            "name": f"压力测试 {self.run_id}",
+            "config": {"question": "Load test", "options": self.OPTIONS}
+        })
+        response.raise_for_status()
+        interaction_id = response.json()["id"]
+        response = await self.client.post(self.base_url + f"/api/admin/interactions/{interaction_id}/toggle?enable=true", headers=cookies)
+        response.raise_for_status()
+        return interaction_id
+
+    async def wait_delivery(self, attendees: List[Attendee], msg_type: str, sent_at: float):
+        """Delivery latency of msg_type to every attendee, measured from sent_at"""
+        async def one(attendee: Attendee):
+            if attendee.ws is None:
+                return
+            try:
+                await asyncio.wait_for(attendee.arrived[msg_type].wait(), self.args.timeout)
+            except asyncio.TimeoutError:
+                self.metrics.missed[msg_type] += 1
+                return
+            self.metrics.delivery[msg_type].append(max(0.0, (attendee.received[msg_type] - sent_at) * 1000))
+        await asyncio.gather(*(one(attendee) for attendee in attendees))
+
+    async def run(self) -> dict:
+        args = self.args
+        limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+        async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+            self.client = client
+            interaction_id = await self.setup()
+            host_token = await self.sign_in(f"lt{self.run_id}-host", "host")
+            if not host_token:
+                raise RuntimeError("Host sign-in failed")
+
+            # Ramp up: sign-ins and sockets spread over --ramp seconds (all at once in a burst)
+            attendees = [Attendee(self, i) for i in range(self.users)]
+            started = time.perf_counter()
+            async def arrive(attendee: Attendee, delay: float):
+                await asyncio.sleep(delay)
+                await attendee.sign_in()
+                if attendee.token:
+                    await attendee.open_socket()
+            await asyncio.gather(*(arrive(a, self.ramp * i / max(1, self.users)) for i, a in enumerate(attendees)))
+            ramp_seconds = time.perf_counter() - started
+            pollers = [asyncio.create_task(a.poll()) for a in attendees if a.token]
+            active = [a for a in attendees if a.token]
+
+            for round_no in range(args.rounds):
+                # Host starts the interaction; users are told by plugin_start
+                for a in active:
+                    a.expect("plugin_start")
+                    a.expect("plugin_end")
+                sent_at = time.perf_counter()
+                await self.request("POST", f"/api/plugin/{interaction_id}/start", "POST /api/plugin/{id}/start", token=host_token)
+                await self.wait_delivery(active, "plugin_start", sent_at)
+
+                await asyncio.gather(*(a.submit(interaction_id, self.OPTIONS) for a in active))
+
+                if round_no % 2 == 0:
+                    sent_at = time.perf_counter()
+                    await self.request("POST", "/api/plugin/stop", "POST /api/plugin/stop", token=host_token)
+                else:
+                    await self.request("POST", "/api/plugin/countdown", "POST /api/plugin/countdown",
+                                       token=host_token, json={"seconds": args.countdown})
+                    # The server stops the interaction when the countdown ends
+                    sent_at = time.perf_counter() + args.countdown
+                await self.wait_delivery(active, "plugin_end", sent_at)
+
+            self.stopping = True
+            for task in pollers:
+                task.cancel()
+            await asyncio.gather(*(a.ws.close() for a in attendees if a.ws is not None), return_exceptions=True)
+
+        report = self.metrics.summary()
+        report.update(scenario=self.scenario, users=self.users, signed_in=len(active), interaction_id=interaction_id, ramp_seconds=round(ramp_seconds, 2))
+        return report
+
+def check_budget(report: dict, args) -> List[str]:
+    violations = []
+    total = sum(r["count"] for r in report["routes"].values())
+    errors = sum(r["errors"] for r in report["routes"].values()) + sum(w["missed"] for w in report["websocket"].values())
+    for route, stats in report["routes"].items():
+        if route.startswith("WS "):
+            continue
+        if args.max_p95 is not None and stats["p95"] > args.max_p95:
+            violations.append(f"{route}: p95 {stats['p95']} ms > {args.max_p95} ms")
+        if args.max_p99 is not None and stats["p99"] > args.max_p99:
+            violations.append(f"{route}: p99 {stats['p99']} ms > {args.max_p99} ms")
+    signin = report["routes"].get("POST /api/signin")
+    if args.max_signin is not None and signin and signin["max"] > args.max_signin:
+        violations.append(f"POST /api/signin: max {signin['max']} ms > {args.max_signin} ms (stalled sign-ins)")
+    if args.max_ws_p95 is not None:
+        for msg_type, stats in report["websocket"].items():
+            if stats["p95"] > args.max_ws_p95:
+                violations.append(f"WebSocket {msg_type}: p95 {stats['p95']} ms > {args.max_ws_p95} ms")
+    if args.max_error_rate is not None and total and errors / total > args.max_error_rate:
+        violations.append(f"error rate {errors / total:.4f} > {args.max_error_rate}")
+    return violations
+
+def print_report(report: dict):
+    print(f"\n=== {report['scenario']}: {report['users']} attendees ({report['signed_in']} signed in, ramp {report['ramp_seconds']}s) ===")
+    print(f"{'route':<34}{'count':>8}{'errors':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for route, s in report["routes"].items():
+        print(f"{route:<34}{s['count']:>8}{s['errors']:>8}{s['p50']:>9}{s['p95']:>9}{s['p99']:>9}{s['max']:>9}")
+    print(f"{'websocket delivery':<34}{'got':>8}{'missed':>8}")
+    for msg_type, s in report["websocket"].items():
+        print(f"{msg_type:<34}{s['delivered']:>8}{s['missed']:>8}{s['p50']:>9}{s['p95']:>9}{s['p99']:>9}{s['max']:>9}")
+    for route, sample in report["error_samples"].items():
+        print(f"  first error of {route}: {sample}")
+
+def raise_file_limit(needed: int):
+    # Every attendee holds a WebSocket plus its share of the HTTP pool
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < needed:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of a running server")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, nargs="+", default=[200], help="attendee counts, one run each (e.g. 200 1000 5000)")
+    parser.add_argument("--plugin", default="demo_vote", help="plugin of the interaction to create")
+    parser.add_argument("--rounds", type=int, default=2, help="start/submit rounds; even rounds end with stop, odd ones with the countdown")
+    parser.add_argument("--countdown", type=int, default=3, help="countdown seconds")
+    parser.add_argument("--scenarios", nargs="+", choices=["ramp", "burst"], default=["ramp", "burst"], help="ramp: arrivals over --ramp seconds; burst: all sign-ins at once")
+    parser.add_argument("--ramp", type=float, default=10, help="seconds over which attendees arrive in the ramp scenario")
+    parser.add_argument("--poll-interval", type=float, default=2, help="seconds between status polls of one attendee")
+    parser.add_argument("--think-time", type=float, default=2, help="max random delay before an attendee submits")
+    parser.add_argument("--connections", type=int, default=200, help="HTTP connection pool size")
+    parser.add_argument("--timeout", type=float, default=30, help="request / delivery timeout in seconds")
+    parser.add_argument("--admin-password", default="admin123")
+    parser.add_argument("--host-password", default="admin123")
+    parser.add_argument("--max-p95", type=float, help="budget: p95 of every HTTP route (ms)")
+    parser.add_argument("--max-p99", type=float, help="budget: p99 of every HTTP route (ms)")
+    parser.add_argument("--max-signin", type=float, default=5000, help="budget: slowest sign-in (ms); catches pool-timeout stalls")
+    parser.add_argument("--max-ws-p95", type=float, help="budget: p95 WebSocket delivery latency (ms)")
+    parser.add_argument("--max-error-rate", type=float, help="budget: failed requests + missed deliveries / requests")
+    parser.add_argument("--json", help="write the reports to this file")
+    args = parser.parse_args()
+
+    raise_file_limit(max(args.users) + args.connections + 256)
+    reports = []
+    failed = False
+    for users in args.users:
+        for scenario in args.scenarios:
+            run_id = f"{int(time.time()) % 100000}{users}{scenario[0]}"
+            report = asyncio.run(LoadTest(args, users, run_id, scenario).run())
+            report["violations"] = check_budget(report, args)
+            reports.append(report)
+            print_report(report)
+            for violation in report["violations"]:
+                print(f"  BUDGET EXCEEDED: {violation}")
+            failed = failed or bool(report["violations"])
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -23,11 +23,25 @@ def run_server():
     print(f"大屏幕入口 (Display): {base_url}/")
     print(f"管理员入口 (Admin): {base_url}/admin")
     print(f"手机签到 (Mobile): {base_url}/signin")
+    print(f"数据库配置档 (DB profile): {os.getenv('APP_DB_PROFILE', 'default')}")
     
     try:
         import uvicorn
-        # reload=True works best when run as a module or with string import
-        uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+        workers = int(os.getenv("APP_WORKERS", "1"))
+        if workers > 1:
+            # Workers must share broadcasts through the broker; the schema is migrated
+            # once here so the workers don't race each other on startup
+            os.environ.setdefault("WS_BROADCAST_BACKEND", "unix")
+            import app.models
+            from app.database import engine, Base
+            from app.migrations import run_migrations
+            Base.metadata.create_all(bind=engine)
+            run_migrations(engine)
+            print(f"工作进程 (Workers): {workers}, 广播 (Broadcast): {os.environ['WS_BROADCAST_BACKEND']}")
+        # Plugins are hot-reloaded in-process (PLUGIN_HOT_RELOAD); a full uvicorn reload
+        # would drop every WebSocket, so it is only enabled for app development (APP_RELOAD=1)
+        reload = os.getenv("APP_RELOAD") == "1" and workers == 1
+        uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=reload, workers=workers)
     except ImportError:
         print("Uvicorn not found after installation? Please run 'pip install uvicorn'")
 
@@ -0,0 +1,50 @@
+import asyncio
+
+from app.results_cache import ResultsCache
+
+
+class SlowPlugin:
+    """get_results() blocks until released, so requests pile up on one computation"""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def get_results(self, event_id, interaction_id):
+        self.calls += 1
+        await self.release.wait()
+        return {"total": self.calls}
+
+
+def test_concurrent_misses_share_one_computation():
+    async def scenario():
+        cache, plugin = ResultsCache(), SlowPlugin()
+        first = asyncio.create_task(cache.get(plugin, 1, 7))
+        second = asyncio.create_task(cache.get(plugin, 1, 7))
+        await asyncio.sleep(0)
+        plugin.release.set()
+        return plugin, await first, await second
+
+    plugin, a, b = asyncio.run(scenario())
+    assert plugin.calls == 1
+    assert a is b
+
+
+def test_waiter_survives_cancelled_computation():
+    # The request computing the snapshot is cancelled while another one waits on it
+    async def scenario():
+        cache, plugin = ResultsCache(), SlowPlugin()
+        computing = asyncio.create_task(cache.get(plugin, 1, 7))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(cache.get(plugin, 1, 7))
+        await asyncio.sleep(0)
+        computing.cancel()
+        await asyncio.sleep(0)
+        plugin.release.set()
+        snapshot = await asyncio.wait_for(waiting, 1)
+        return computing, snapshot, cache
+
+    computing, snapshot, cache = asyncio.run(scenario())
+    assert computing.cancelled()
+    assert snapshot.results == {"total": 2}
+    assert not cache._pending
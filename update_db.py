@@ -1,32 +1,11 @@
-import sqlite3
+from app.migrations import run_migrations, schema_version
 
 def upgrade_db():
-    conn = sqlite3.connect('app.db')
-    cursor = conn.cursor()
-    
-    try:
-        print("Adding custom_plugins column to events table...")
-        cursor.execute("ALTER TABLE events ADD COLUMN custom_plugins JSON")
-        print("Success.")
-    except sqlite3.OperationalError as e:
-        print(f"Skipping events update: {e}")
-        
-    try:
-        print("Adding current_interaction_id column to events table...")
-        cursor.execute("ALTER TABLE events ADD COLUMN current_interaction_id INTEGER")
-        print("Success.")
-    except sqlite3.OperationalError as e:
-        print(f"Skipping events update (current_interaction_id): {e}")
-
-    try:
-        print("Adding interaction_count column to participants table...")
-        cursor.execute("ALTER TABLE participants ADD COLUMN interaction_count INTEGER DEFAULT 0")
-        print("Success.")
-    except sqlite3.OperationalError as e:
-        print(f"Skipping participants update (interaction_count): {e}")
-
-    conn.commit()
-    conn.close()
+    # Schema changes now live in app/migrations.py and also run on server startup;
+    # this script stays for upgrading an app.db without starting the server
+    print(f"Current schema version: {schema_version()}")
+    version = run_migrations()
+    print(f"Database is at schema version {version}.")
 
 if __name__ == "__main__":
     upgrade_db()